@@ -0,0 +1,70 @@
+import json
+import math
+import os
+import tempfile
+
+from portfolio import create_app
+from portfolio.auth import get_hasher
+from portfolio.db import get_pool, init_db, seed_db
+from portfolio.writer import get_writer
+
+# Every seeded user has this password, so the benchmarks can log in as any of them.
+PASSWORD = 'password'
+
+
+# Builds an app on a new temporary database. `config` overrides the app's defaults, the same way test_config does.
+def make_app(config=None):
+    db_fd, db_path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(db_fd)
+    app = create_app(dict({'DATABASE': db_path}, **(config or {})))
+
+    with app.app_context():
+        init_db()
+
+    return app
+
+
+def close_app(app):
+    get_pool(app).close()
+    get_hasher(app).shutdown()
+    get_writer(app).close()
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.remove(app.config['DATABASE'] + suffix)
+        except OSError:
+            pass
+
+
+# Fills the database with `users` users and `posts` posts spread over them,
+# with post bodies `body_length` characters long on average.
+def seed(app, users, posts, body_length, seed=0):
+    with app.app_context():
+        seed_db(users, posts, body_length, seed=seed, password=PASSWORD)
+
+
+# Reduces a list of request durations in seconds, measured over `elapsed` seconds of wall time, to the numbers that get reported.
+# The nearest-rank percentile of sorted timings: the smallest one that `percent` percent of them are no greater than.
+# Computed by hand because statistics.quantiles() is new in Python 3.8.
+def percentile(ordered, percent):
+    return ordered[max(math.ceil(len(ordered) * percent / 100) - 1, 0)]
+
+
+def summarize(timings, elapsed, errors=0):
+    ordered = sorted(timings)
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'p50_ms': round(percentile(ordered, 50) * 1000, 3) if ordered else None,
+        'p95_ms': round(percentile(ordered, 95) * 1000, 3) if ordered else None,
+        'p99_ms': round(percentile(ordered, 99) * 1000, 3) if ordered else None,
+        'req_per_s': round(len(timings) / elapsed, 1) if elapsed else None,
+    }
+
+
+def write_report(report, output=None):
+    text = json.dumps(report, indent=2)
+    if output is None:
+        print(text)
+    else:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
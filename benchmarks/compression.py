@@ -0,0 +1,94 @@
+import argparse
+import time
+import zlib
+
+from benchmarks.common import close_app, make_app, seed, write_report
+from portfolio.compress import ENCODINGS
+
+# Measures what compressing index pages costs in CPU time against the bytes it saves, for each encoding and zlib level.
+# The pages are real index pages of a seeded database, rendered uncompressed and then compressed the way the app does it:
+# whole, and in pieces with a flush after each one, like a streamed page.
+#
+# To run:
+# $ python -m benchmarks.compression --body-length 500 2000 --levels 1 6 9
+
+
+def fetch_pages(app, count):
+    client = app.test_client()
+    pages = []
+    path = '/'
+    for _ in range(count):
+        response = client.get(path)
+        pages.append(response.data)
+        older = response.data.split(b'href="/?older=', 1)
+        if len(older) < 2:
+            break
+        path = '/?older=' + older[1].split(b'"', 1)[0].decode().replace('&amp;', '&')
+    return pages
+
+
+def compress(page, encoding, level, chunk_size):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+    if chunk_size is None:
+        return len(compressor.compress(page) + compressor.flush())
+
+    size = 0
+    for start in range(0, len(page), chunk_size):
+        size += len(compressor.compress(page[start:start + chunk_size]) + compressor.flush(zlib.Z_SYNC_FLUSH))
+    return size + len(compressor.flush())
+
+
+def measure(pages, encoding, level, chunk_size, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        compressed = sum(compress(page, encoding, level, chunk_size) for page in pages)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    original = sum(len(page) for page in pages)
+    return {
+        'encoding': encoding,
+        'level': level,
+        'streamed': chunk_size is not None,
+        'ms_per_page': round(best / len(pages) * 1000, 3),
+        'bytes_per_page': round(original / len(pages)),
+        'compressed_bytes_per_page': round(compressed / len(pages)),
+        'saved_percent': round((1 - compressed / original) * 100, 1),
+        # Bytes saved per millisecond of CPU, higher is better.
+        'saved_bytes_per_ms': round((original - compressed) / (best * 1000)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the CPU cost and savings of compressing index pages.')
+    parser.add_argument('--posts', type=int, default=2000)
+    parser.add_argument('--body-length', type=int, nargs='+', default=[200, 500, 2000])
+    parser.add_argument('--pages', type=int, default=20, help='Index pages to compress for each body length.')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 6, 9])
+    parser.add_argument('--chunk-size', type=int, default=4096,
+                        help='Bytes between flushes when compressing as a stream.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+    args = parser.parse_args(argv)
+
+    report = {'config': vars(args), 'results': []}
+    for body_length in args.body_length:
+        app = make_app({'COMPRESS_RESPONSES': False})
+        try:
+            seed(app, 100, args.posts, body_length)
+            pages = fetch_pages(app, args.pages)
+        finally:
+            close_app(app)
+
+        for encoding in ENCODINGS:
+            for level in args.levels:
+                for chunk_size in (None, args.chunk_size):
+                    result = measure(pages, encoding, level, chunk_size, args.repeat)
+                    report['results'].append(dict(body_length=body_length, **result))
+
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import random
+import time
+
+from benchmarks.common import close_app, make_app, seed, write_report
+from portfolio.db import get_db
+from portfolio.queries import QUERIES
+
+# Compares reading posts with a join to the user table for the author's username, as the app did before,
+# against reading the author_username copy on the post itself, for the index pages and single posts.
+#
+# To run:
+# $ python -m benchmarks.denormalize --posts 1000000
+
+JOIN_QUERIES = {
+    'first_page': (
+        'SELECT p.id, title, excerpt, body_length, word_count, truncated, CAST(created AS TEXT) AS created, author_id, username'
+        ' FROM post p JOIN user u ON p.author_id = u.id'
+        ' ORDER BY p.created DESC, p.id DESC'
+        ' LIMIT ?'
+    ),
+    'older_page': (
+        'SELECT p.id, title, excerpt, body_length, word_count, truncated, CAST(created AS TEXT) AS created, author_id, username'
+        ' FROM post p JOIN user u ON p.author_id = u.id'
+        ' WHERE (p.created, p.id) < (?, ?)'
+        ' ORDER BY p.created DESC, p.id DESC'
+        ' LIMIT ?'
+    ),
+    'post_by_id': (
+        'SELECT p.id, title, body, word_count, created, author_id, username'
+        ' FROM post p JOIN user u ON p.author_id = u.id'
+        ' WHERE p.id = ?'
+    ),
+}
+
+DENORMALIZED_QUERIES = {
+    'first_page': QUERIES['posts_first_page'],
+    'older_page': QUERIES['posts_older_page'],
+    'post_by_id': QUERIES['post_by_id'],
+}
+
+
+# Runs every query in `parameters` `repeat` times and returns the best time per query in microseconds.
+def per_query_us(db, sql, parameters, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for values in parameters:
+            db.execute(sql, values).fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / len(parameters) * 1e6, 2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare reading posts with a join against the denormalized username.')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--body-length', type=int, default=200)
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=500, help='Queries per run, each with different parameters.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+    args = parser.parse_args(argv)
+
+    app = make_app()
+    report = {'config': vars(args), 'results': []}
+    try:
+        seed(app, args.users, args.posts, args.body_length)
+        with app.app_context():
+            db = get_db()
+            rng = random.Random(0)
+            posts = db.execute('SELECT CAST(created AS TEXT), id FROM post').fetchall()
+            cursors = [tuple(rng.choice(posts)) for _ in range(args.queries)]
+            parameters = {
+                'first_page': [(args.page_size + 1,)] * args.queries,
+                'older_page': [cursor + (args.page_size + 1,) for cursor in cursors],
+                'post_by_id': [(cursor[1],) for cursor in cursors],
+            }
+            del posts
+
+            for name, values in parameters.items():
+                join = per_query_us(db, JOIN_QUERIES[name], values, args.repeat)
+                denormalized = per_query_us(db, DENORMALIZED_QUERIES[name], values, args.repeat)
+                report['results'].append({
+                    'query': name,
+                    'join_us': join,
+                    'denormalized_us': denormalized,
+                    'speedup': round(join / denormalized, 2),
+                })
+    finally:
+        close_app(app)
+
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlencode
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from benchmarks.common import PASSWORD, close_app, make_app, seed, summarize, write_report
+from portfolio import queries
+from portfolio.blog import make_cursor
+from portfolio.db import get_db
+
+# Times every route of the app against a seeded database, both through Flask's test client
+# (the app's own cost) and through a threaded WSGI server over real HTTP (what a client sees).
+#
+# To run:
+# $ python -m benchmarks.routes --posts 100000 --requests 500 --output before.json
+# Compare the JSON reports of two commits to spot regressions.
+
+# The benchmarks log in as the first seeded user, who is the author of every `users`th post.
+USERNAME = 'user1'
+
+
+# Each scenario returns the requests to time as (method, path, form data) tuples, and whether they need a logged in user.
+def index(app, count):
+    return [('GET', '/', None)] * count, False
+
+
+# A page from the middle of the post history, to show that deep pages cost the same as the first.
+def index_deep(app, count):
+    with app.app_context():
+        db = get_db()
+        middle = db.execute('SELECT COUNT(*) FROM post').fetchone()[0] // 2
+        post = db.execute(
+            'SELECT id, created FROM post ORDER BY created DESC, id DESC LIMIT 1 OFFSET ?', (middle,)
+        ).fetchone()
+    return [('GET', '/?' + urlencode({'older': make_cursor(post)}), None)] * count, False
+
+
+def login(app, count):
+    return [('POST', '/auth/login', {'username': USERNAME, 'password': PASSWORD})] * count, False
+
+
+def create(app, count):
+    return [('POST', '/create', {'title': f'new post {n}', 'body': 'new body'}) for n in range(count)], True
+
+
+def update(app, count):
+    with app.app_context():
+        ids = [row[0] for row in get_db().execute('SELECT id FROM post WHERE author_id = 1')]
+    return [
+        ('POST', f'/{ids[n % len(ids)]}/update', {'title': f'updated {n}', 'body': 'updated body'})
+        for n in range(count)
+    ], True
+
+
+# Every delete needs a post of its own, so they are added first.
+def delete(app, count):
+    with app.app_context():
+        db = get_db()
+        first = db.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM post').fetchone()[0]
+        db.executemany(
+            "INSERT INTO post (title, body, author_id) VALUES ('to delete', '', 1)", [()] * count
+        )
+        db.commit()
+    return [('POST', f'/{id}/delete', None) for id in range(first, first + count)], True
+
+
+SCENARIOS = {
+    'index': index,
+    'index_deep': index_deep,
+    'login': login,
+    'create': create,
+    'update': update,
+    'delete': delete,
+}
+
+
+def run_test_client(app, requests, logged_in):
+    client = app.test_client()
+    if logged_in:
+        client.post('/auth/login', data={'username': USERNAME, 'password': PASSWORD})
+
+    timings = []
+    errors = 0
+    started = time.perf_counter()
+    for method, path, data in requests:
+        start = time.perf_counter()
+        response = client.open(path, method=method, data=data)
+        timings.append(time.perf_counter() - start)
+        errors += response.status_code >= 400
+    elapsed = time.perf_counter() - started
+
+    return summarize(timings, elapsed, errors)
+
+
+# Keeps the server's access log from drowning the report.
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+# Sends the requests over HTTP from `concurrency` threads, each with its own session.
+def run_wsgi(app, requests, logged_in, concurrency):
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def send(method, path, data, cookie=None):
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_port)
+        headers = {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if cookie is not None:
+            headers['Cookie'] = cookie
+        connection.request(method, path, body, headers)
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        return response
+
+    timings = []
+    errors = []
+    # Logging in isn't part of the measurement, so the clock starts once every thread has its session.
+    ready = threading.Barrier(concurrency + 1)
+
+    def worker(requests):
+        cookie = None
+        if logged_in:
+            response = send('POST', '/auth/login', {'username': USERNAME, 'password': PASSWORD})
+            cookie = response.getheader('Set-Cookie').split(';', 1)[0]
+        ready.wait()
+
+        for method, path, data in requests:
+            start = time.perf_counter()
+            response = send(method, path, data, cookie)
+            timings.append(time.perf_counter() - start)
+            errors.append(response.status >= 400)
+
+    threads = [threading.Thread(target=worker, args=(requests[n::concurrency],)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    return summarize(timings, elapsed, sum(errors))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the latency and throughput of every route.')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--body-length', type=int, default=500, help='Average post body length in characters.')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per route and client.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Client threads for the WSGI server.')
+    parser.add_argument('--clients', nargs='+', choices=('test_client', 'wsgi'), default=['test_client', 'wsgi'])
+    parser.add_argument('--routes', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=JSON',
+                        help='Override an app config value, e.g. --set PAGE_CACHE_BACKEND=null.')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+    args = parser.parse_args(argv)
+
+    config = {}
+    for setting in args.set:
+        key, _, value = setting.partition('=')
+        config[key] = json.loads(value)
+
+    report = {'config': dict(vars(args), set=config), 'results': []}
+    for client in args.clients:
+        for route in args.routes:
+            # Every run starts from the same database, so earlier runs don't change what later ones measure.
+            app = make_app(config)
+            try:
+                seed(app, args.users, args.posts, args.body_length)
+                requests, logged_in = SCENARIOS[route](app, args.requests)
+                queries.reset_stats()
+                if client == 'test_client':
+                    result = run_test_client(app, requests, logged_in)
+                else:
+                    result = run_wsgi(app, requests, logged_in, args.concurrency)
+            finally:
+                close_app(app)
+            statements = queries.stats()
+            result['statement_cache'] = {'hits': statements['hits'], 'misses': statements['misses']}
+            report['results'].append(dict(route=route, client=client, **result))
+
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
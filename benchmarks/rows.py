@@ -0,0 +1,85 @@
+import argparse
+import time
+
+from flask import g, render_template
+
+from benchmarks.common import close_app, make_app, seed, write_report
+from portfolio.blog import PostsPage
+from portfolio.db import get_db
+from portfolio.queries import execute
+
+# Compares the per-row cost of sqlite3.Row with PARSE_DECLTYPES against FastRow on index pages of different sizes,
+# for fetching the rows alone and for fetching and rendering them with blog/index.html.
+#
+# To run:
+# $ python -m benchmarks.rows --page-sizes 20 200 2000
+
+# The posts_first_page query with sqlite3.Row, as the index read its rows before FastRow. It selects the same columns,
+# but leaves created as it is stored, so sqlite3 parses every timestamp into a datetime. Only the row type differs.
+ROW_QUERY = (
+    'SELECT p.id, title, excerpt, body_length, word_count, truncated, created, author_id, author_username AS username'
+    ' FROM post p'
+    ' ORDER BY p.created DESC, p.id DESC'
+    ' LIMIT ?'
+)
+
+
+def fetch_rows(page_size):
+    return get_db().execute(ROW_QUERY, (page_size,)).fetchall()
+
+
+def fetch_fast_rows(page_size):
+    return execute(get_db(), 'posts_first_page', (page_size,)).fetchall()
+
+
+def render(posts):
+    return render_template('blog/index.html', page=PostsPage(posts, len(posts), has_newer=False))
+
+
+# Runs `fn` `repeat` times and returns the best time per row in microseconds.
+# The best run is the one least disturbed by the rest of the system.
+def per_row_us(fn, page_size, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / page_size * 1e6, 3)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the per-row cost of index pages with sqlite3.Row and FastRow.')
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--body-length', type=int, default=200)
+    parser.add_argument('--page-sizes', type=int, nargs='+', default=[20, 200, 2000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+    args = parser.parse_args(argv)
+
+    app = make_app()
+    report = {'config': vars(args), 'results': []}
+    try:
+        seed(app, 100, args.posts, args.body_length)
+        with app.test_request_context('/'):
+            g.user = None
+            for page_size in args.page_sizes:
+                report['results'].append({
+                    'page_size': page_size,
+                    'fetch_us_per_row': {
+                        'sqlite3_row': per_row_us(lambda: fetch_rows(page_size), page_size, args.repeat),
+                        'fast_row': per_row_us(lambda: fetch_fast_rows(page_size), page_size, args.repeat),
+                    },
+                    'fetch_and_render_us_per_row': {
+                        'sqlite3_row': per_row_us(lambda: render(fetch_rows(page_size)), page_size, args.repeat),
+                        'fast_row': per_row_us(lambda: render(fetch_fast_rows(page_size)), page_size, args.repeat),
+                    },
+                })
+    finally:
+        close_app(app)
+
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
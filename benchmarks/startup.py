@@ -0,0 +1,82 @@
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.common import close_app, make_app, seed, write_report
+
+# Measures how long a fresh worker process takes to serve its first response of every page (medians of --runs runs),
+# with no template bytecode cache, with a cold one and with one filled by `flask compile-templates`.
+#
+# To run:
+# $ python -m benchmarks.startup --runs 10
+
+# Run in a new process for every measurement, so nothing is already imported or compiled.
+CHILD = '''
+import sys, time
+start = time.perf_counter()
+from portfolio import create_app
+config = {'DATABASE': sys.argv[1], 'TEMPLATE_BYTECODE_CACHE': sys.argv[2] != '-', 'TEMPLATE_CACHE_DIR': sys.argv[2]}
+client = create_app(config).test_client()
+created = time.perf_counter()
+for path in ('/', '/auth/login', '/auth/register'):
+    assert client.get(path).status_code == 200
+# Logging in through the session instead of the login form keeps password hashing out of the measurement.
+with client.session_transaction() as session:
+    session['user_id'] = 1
+for path in ('/', '/create', '/1/update'):
+    assert client.get(path).status_code == 200
+print(created - start, time.perf_counter() - created)
+'''
+
+
+# Returns the milliseconds a new process took to import and create the app, and then to serve its first pages.
+def first_response_ms(database, cache_dir):
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, database, cache_dir],
+        check=True, stdout=subprocess.PIPE, universal_newlines=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ).stdout
+    return [float(seconds) * 1000 for seconds in output.split()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure time to first response with and without the template bytecode cache.')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+    args = parser.parse_args(argv)
+
+    app = make_app()
+    cache_dir = tempfile.mkdtemp()
+    results = {'no_cache': [], 'cold_cache': [], 'compiled_cache': []}
+    try:
+        seed(app, 10, 100, 200)
+        database = app.config['DATABASE']
+        for _ in range(args.runs):
+            results['no_cache'].append(first_response_ms(database, '-'))
+
+            shutil.rmtree(cache_dir)
+            os.mkdir(cache_dir)
+            results['cold_cache'].append(first_response_ms(database, cache_dir))
+
+        # The cold runs left every template compiled in the cache, which is what `flask compile-templates` gives every new worker.
+        for _ in range(args.runs):
+            results['compiled_cache'].append(first_response_ms(database, cache_dir))
+    finally:
+        close_app(app)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    report = {'config': vars(args), 'results': {}}
+    for mode, timings in results.items():
+        report['results'][mode] = {
+            'create_app_ms': round(statistics.median(timing[0] for timing in timings), 3),
+            'first_responses_ms': round(statistics.median(timing[1] for timing in timings), 3),
+        }
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
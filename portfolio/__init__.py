@@ -8,6 +8,80 @@ def create_app(test_config=None):
     app.config.from_mapping(
         SECRET_KEY='dev',
         DATABASE=os.path.join(app.instance_path, 'portfolio.sqlite'),
+        # PRAGMAs applied to every new database connection.
+        SQLITE_PRAGMAS={
+            # Write-ahead logging lets readers keep reading while a post or user is being written.
+            'journal_mode': 'wal',
+            # In WAL mode NORMAL is still safe against corruption and skips an fsync on every commit.
+            'synchronous': 'normal',
+            # Page cache per connection, negative values are in KiB.
+            'cache_size': -8000,
+            'mmap_size': 64 * 1024 * 1024,
+            'temp_store': 'memory',
+            # Milliseconds to wait for a lock held by another connection before failing with 'database is locked'.
+            'busy_timeout': 5000,
+        },
+        # Most database connections each process keeps, and how many seconds a request waits for one when they are all in use.
+        DATABASE_POOL_SIZE=8,
+        DATABASE_POOL_TIMEOUT=5.0,
+        # Seconds a pooled connection can sit idle before it is checked before reuse.
+        DATABASE_POOL_CHECK_INTERVAL=30.0,
+        # Prepared statements each pooled connection keeps.
+        DATABASE_STATEMENT_CACHE=256,
+        # How passwords are hashed. Existing hashes are upgraded to these settings when their user logs in.
+        # Run `flask calibrate-password-hash` to find the iteration count that fits this host.
+        PASSWORD_HASH_METHOD='pbkdf2:sha256',
+        PASSWORD_HASH_ITERATIONS=150000,
+        # Worker processes that hash passwords (None for one per CPU), how many more hashes may wait for a worker,
+        # and the Retry-After seconds sent with the 503 when that queue is full.
+        PASSWORD_HASH_WORKERS=None,
+        PASSWORD_HASH_MAX_QUEUED=32,
+        PASSWORD_HASH_RETRY_AFTER=1,
+        # How many logged in users each process keeps in memory, and for how many seconds,
+        # so requests don't have to look them up in the database.
+        USER_CACHE_SIZE=1024,
+        USER_CACHE_TTL=60,
+        # Fraction of requests whose SQL statements are timed and reported in a Server-Timing header,
+        # and the time in milliseconds above which a timed statement is logged as slow.
+        QUERY_SAMPLE_RATE=0.1,
+        SLOW_QUERY_MS=100,
+        # Number of posts shown on each page of the blog index.
+        POSTS_PER_PAGE=20,
+        # Longest excerpt of a post shown on the index, in characters. Changing it only affects posts written afterwards.
+        POST_EXCERPT_LENGTH=300,
+        # Send the index page while it is being rendered instead of after, and how many template pieces go in each write.
+        INDEX_STREAMING=False,
+        STREAM_BUFFER_SIZE=16,
+        # Keep compiled templates on disk so new worker processes don't compile them again.
+        # The directory defaults to template_cache in the instance folder, `flask compile-templates` fills it ahead of time.
+        TEMPLATE_BYTECODE_CACHE=True,
+        TEMPLATE_CACHE_DIR=None,
+        # Where `flask build-assets` puts the fingerprinted and compressed static files, defaults to assets in the instance folder,
+        # and the max-age in seconds they are sent with.
+        ASSETS_DIR=None,
+        ASSETS_MAX_AGE=365 * 24 * 60 * 60,
+        # Compress responses with gzip or deflate for clients that accept it, at this zlib level (1 fastest, 9 smallest).
+        # Responses smaller than COMPRESS_MIN_SIZE bytes are sent as they are, and only these content types are compressed.
+        COMPRESS_RESPONSES=True,
+        COMPRESS_LEVEL=6,
+        COMPRESS_MIN_SIZE=1024,
+        COMPRESS_MIMETYPES={
+            'text/html', 'text/css', 'text/plain', 'text/javascript',
+            'application/javascript', 'application/json', 'image/svg+xml',
+        },
+        # Commit new, edited and deleted posts in batches from one writer thread instead of one commit per request.
+        # The writer waits up to GROUP_COMMIT_MAX_DELAY seconds after a write for others to share its commit,
+        # and commits at most GROUP_COMMIT_MAX_BATCH writes at once.
+        GROUP_COMMIT=False,
+        GROUP_COMMIT_MAX_BATCH=100,
+        GROUP_COMMIT_MAX_DELAY=0.005,
+        # Where pages rendered for logged-out visitors are cached: 'memory' (per process), 'file' (shared by the processes on a host),
+        # None to turn caching off, or a function that takes the app and returns a cache object.
+        PAGE_CACHE_BACKEND='memory',
+        # Total size of the cached pages, least recently used pages are dropped first.
+        PAGE_CACHE_MAX_BYTES=16 * 1024 * 1024,
+        # Directory for the 'file' backend, defaults to page_cache in the instance folder.
+        PAGE_CACHE_DIR=None,
     )
 
     if test_config is None:
@@ -26,13 +100,29 @@ def create_app(test_config=None):
     # A simple page that says hello
     @app.route('/hello')
     def hello():
-        return 'Hello, World'
+        return 'Hello, World!'
 
     from . import db
     db.init_app(app)
 
+    from . import writer
+    writer.init_app(app)
+
+    from . import cache
+    cache.init_app(app)
+
+    from . import templating
+    templating.init_app(app)
+
+    from . import assets
+    assets.init_app(app)
+
+    from . import compress
+    compress.init_app(app)
+
     # The authentication blueprint will have views to register new users and to log in and log out.
     from . import auth
+    auth.init_app(app)
     app.register_blueprint(auth.bp)
 
     # Add block blueprint for blog posts to factory
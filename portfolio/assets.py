@@ -0,0 +1,144 @@
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import tempfile
+
+import click
+from flask import current_app, request, safe_join, send_from_directory
+from flask.cli import with_appcontext
+
+# brotli is optional, without it assets are only precompressed with gzip.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# `flask build-assets` copies every file in the static folder into ASSETS_DIR under a name that contains a hash of its content,
+# e.g. style.css becomes style.3f2a9c1b7d4e.css, and writes compressed copies next to it (style.3f2a9c1b7d4e.css.gz).
+# The manifest maps each original name to its hashed name, so url_for('static', filename='style.css') links to the hashed file.
+# A hashed file never changes, so browsers can keep it for as long as they like, and a new build changes the links instead.
+MANIFEST = 'manifest.json'
+
+def gzip_compress(data):
+    # The timestamp in the gzip header is zeroed, so building the same file twice gives the same bytes.
+    # gzip.compress() only takes mtime from Python 3.8 on, so the file is written through a GzipFile.
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+# The encodings assets are precompressed with, most preferred first, as (Content-Encoding, file suffix, compress function).
+ENCODINGS = [('gzip', '.gz', gzip_compress)]
+if brotli is not None:
+    ENCODINGS.insert(0, ('br', '.br', lambda data: brotli.compress(data, quality=11)))
+
+
+def get_assets_dir(app):
+    return app.config['ASSETS_DIR'] or os.path.join(app.instance_path, 'assets')
+
+
+def hashed_name(name, data):
+    root, ext = os.path.splitext(name)
+    return f'{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written to a temporary file and renamed into place, so a running server never sends half a file.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+# Builds the assets of every file in `static_folder` into `directory` and returns the manifest.
+# Files of earlier builds are left in place, so pages rendered before a deploy can still load the assets they link to.
+def build_assets(static_folder, directory):
+    manifest = {}
+
+    for root, _, files in os.walk(static_folder):
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            # Static URLs always use forward slashes.
+            name = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            hashed = hashed_name(name, data)
+            manifest[name] = hashed
+            write_file(os.path.join(directory, hashed), data)
+            for _, suffix, compress in ENCODINGS:
+                compressed = compress(data)
+                # Files that are already compressed, like images, don't get any smaller.
+                if len(compressed) < len(data):
+                    write_file(os.path.join(directory, hashed + suffix), compressed)
+
+    write_file(os.path.join(directory, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf8'))
+    return manifest
+
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST), 'rb') as f:
+            return json.loads(f.read().decode('utf8'))
+    except (OSError, ValueError):
+        return {}
+
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    # Fingerprint and precompress the static files. Run it after changing anything in the static folder.
+    directory = get_assets_dir(current_app)
+    manifest = build_assets(current_app.static_folder, directory)
+    current_app.extensions['portfolio_assets'] = manifest
+    click.echo(f'Built {len(manifest)} assets into {directory}.')
+
+
+# Points url_for('static', ...) at the hashed name of the file, if it has been built.
+def hashed_static_url(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        manifest = current_app.extensions['portfolio_assets']
+        values['filename'] = manifest.get(values['filename'], values['filename'])
+
+
+# Replaces Flask's static view. Hashed files are sent from ASSETS_DIR, compressed if the client accepts it,
+# with a Cache-Control that lets browsers keep them without ever checking back. Anything else is sent as before.
+def send_static_file(filename):
+    directory = get_assets_dir(current_app)
+    path = safe_join(directory, filename)
+    if path is None or filename == MANIFEST or not os.path.isfile(path):
+        return current_app.send_static_file(filename)
+
+    suffix = ''
+    encoding = None
+    for name, variant_suffix, _ in ENCODINGS:
+        if request.accept_encodings[name] and os.path.isfile(path + variant_suffix):
+            encoding, suffix = name, variant_suffix
+            break
+
+    response = send_from_directory(
+        directory, filename + suffix,
+        # The type of the original file, not of the .gz file.
+        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        cache_timeout=current_app.config['ASSETS_MAX_AGE'],
+    )
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    # The manifest is read once per process, so a new build takes effect when the server restarts.
+    # Without a manifest url_for links to the original files, which are served as before.
+    app.extensions['portfolio_assets'] = load_manifest(get_assets_dir(app))
+    app.url_default_functions.setdefault(None, []).append(hashed_static_url)
+    app.view_functions['static'] = send_static_file
+    app.cli.add_command(build_assets_command)
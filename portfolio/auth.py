@@ -1,15 +1,99 @@
 import functools
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-from flask import Blueprint, flash, g, redirect, render_template, request, session, url_for
+import click
+from flask import Blueprint, current_app, flash, g, redirect, render_template, request, session, url_for
+from flask.cli import with_appcontext
+from werkzeug.exceptions import ServiceUnavailable
 from werkzeug.security import check_password_hash, generate_password_hash
 
+from portfolio.cache import TTLCache
 from portfolio.db import get_db
+from portfolio.queries import execute
 
 # Creates a Blueprint named 'auth'. Like the application object, the blueprint needs to know where it’s defined, so __name__ is passed as the second argument.
 # The url_prefix will be prepended to all the URLs associated with the blueprint.
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
 
+# The Werkzeug method string for new password hashes, e.g. 'pbkdf2:sha256:150000'.
+# The iteration count sets how much CPU every login and registration costs, see `flask calibrate-password-hash`.
+def password_hash_method():
+    return f"{current_app.config['PASSWORD_HASH_METHOD']}:{current_app.config['PASSWORD_HASH_ITERATIONS']}"
+
+
+# Password hashing is CPU-bound, so it runs in a pool of worker processes instead of on the request thread,
+# leaving the request threads free to serve other pages during a burst of logins.
+# At most `workers + max_queued` hashes are in flight. Past that, new ones are refused with a 503 instead of piling up.
+class Hasher(object):
+    def __init__(self, workers, max_queued, retry_after):
+        self.workers = workers
+        self.max_queued = max_queued
+        # Seconds a client refused with a 503 is told to wait before trying again.
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers + max_queued)
+        self._executor = None
+        self._pid = os.getpid()
+
+    def _get_executor(self):
+        with self._lock:
+            # A forked child can't use its parent's worker processes, so it starts its own.
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(self.workers)
+                self._pid = os.getpid()
+            return self._executor
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise ServiceUnavailable(
+                'Too many logins are being processed, please try again shortly.',
+                retry_after=self.retry_after,
+            )
+
+        try:
+            return self._get_executor().submit(fn, *args).result()
+        except BrokenProcessPool:
+            # A worker died. Drop the pool so the next hash starts a fresh one.
+            with self._lock:
+                self._executor = None
+            raise
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown()
+
+
+def get_hasher(app=None):
+    if app is None:
+        app = current_app
+    return app.extensions['portfolio_hasher']
+
+
+def hash_password(password):
+    return get_hasher().run(generate_password_hash, password, password_hash_method())
+
+
+def verify_password(password_hash, password):
+    return get_hasher().run(check_password_hash, password_hash, password)
+
+
+# Stored hashes start with the method they were made with, e.g. 'pbkdf2:sha256:50000$salt$hash'.
+# A hash made with other settings than the current ones is replaced the next time its user logs in.
+def needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != password_hash_method()
+
+
 @bp.route('/register', methods=('GET', 'POST'))
 def register():
     if request.method == 'POST':
@@ -26,19 +110,16 @@ def register():
         elif not password:
             error = 'Password is required.'
         # Validate that username is not already registered by querying the database and checking if a result is returned.
-        elif db.execute(
-            'SELECT id FROM user WHERE username = ?', (username,)
+        elif execute(
+            db, 'user_exists', (username,)
             # fetchone() returns one row from the query.
         ).fetchone() is not None:
             error = f'User {username} is already registered'
 
         if error is None:
             # If validation succeeds, insert the new user data into the database.
-            # generate_password_hash() is used to securely hash the password, and that hash is stored.
-            db.execute(
-                'INSERT INTO user (username, password) VALUES (?, ?)',
-                (username, generate_password_hash(password))
-            )
+            # hash_password() is used to securely hash the password, and that hash is stored.
+            execute(db, 'insert_user', (username, hash_password(password)))
             # Since this query modifies data, db.commit() needs to be called afterwards to save the changes.
             db.commit()
             # After storing the user, they are redirected to the login page.
@@ -60,18 +141,28 @@ def login():
         db = get_db()
         error = None
         # The user is queried first and stored in a variable for later use.
-        user = db.execute(
-            'SELECT * FROM user WHERE username = ?', (username,)
-        ).fetchone()
+        user = execute(db, 'user_by_username', (username,)).fetchone()
 
         if user is None:
             error = 'Incorrect username.'
-        # check_password_hash() hashes the submitted password in the same way as the stored hash and securely compares them. If they match, the password is valid.
-        elif not check_password_hash(user['password'], password):
+        # verify_password() hashes the submitted password in the same way as the stored hash and securely compares them. If they match, the password is valid.
+        elif not verify_password(user['password'], password):
             error = 'Incorrect password.'
 
         # session is a dict that stores data across requests.
         if error is None:
+            # The password is only known now, so this is the moment to upgrade a hash made with old settings.
+            # The upgrade is best effort: if the hasher is too busy to make the new hash, the login goes ahead with the old one.
+            if needs_rehash(user['password']):
+                try:
+                    password_hash = hash_password(password)
+                except ServiceUnavailable:
+                    pass
+                else:
+                    execute(db, 'update_user_password', (password_hash, user['id']))
+                    db.commit()
+                    user_changed(user['id'])
+
             session.clear()
             # When validation succeeds, the user’s id is stored in a new session.
             # The data is stored in a cookie that is sent to the browser, and the browser then sends it back with subsequent requests.
@@ -82,21 +173,41 @@ def login():
 
     return render_template('auth/login.html')
 
+# Endpoints that never look at g.user, so loading the user for them would be wasted work.
+USER_FREE_ENDPOINTS = {'static', 'hello'}
+
+
+def get_user_cache():
+    return current_app.extensions['portfolio_user_cache']
+
+
+# Must be called after a change to a user row is committed, so the next request reads the new data.
+# Other processes have their own cache and pick the change up within USER_CACHE_TTL seconds.
+def user_changed(user_id):
+    get_user_cache().delete(user_id)
+
 # bp.before_app_request() registers a function that runs before the view function, no matter what URL is requested
 
 
 @bp.before_app_request
 # checks if a user id is stored in the session and gets that user’s data from the database, storing it on g.user, which lasts for the length of the request.
 def load_logged_in_user():
+    if request.endpoint in USER_FREE_ENDPOINTS:
+        return
+
     user_id = session.get('user_id')
 
     # If there is no user id, or if the id doesn’t exist, g.user will be None.
     if user_id is None:
         g.user = None
-    else:
-        g.user = get_db().execute(
-            'SELECT * FROM user WHERE id = ?', (user_id,)
-        ).fetchone()
+        return
+
+    # The user is looked up in the user cache first, so most requests don't need a query for it.
+    g.user = get_user_cache().get(user_id)
+    if g.user is None:
+        g.user = execute(get_db(), 'user_by_id', (user_id,)).fetchone()
+        if g.user is not None:
+            get_user_cache().set(user_id, g.user)
 
 
 @bp.route('/logout')
@@ -114,7 +225,7 @@ def login_required(view):
     def wrapped_view(**kwargs):
         # Checks if a user is loaded and redirects to the login page otherwise.
         if g.user is None:
-            return redirect(url_for('auth.lofin'))
+            return redirect(url_for('auth.login'))
 
         # If a user is loaded the original view is called and continues normally
         return view(**kwargs)
@@ -123,3 +234,33 @@ def login_required(view):
 
 # When using a blueprint, the name of the blueprint is prepended to the name of the function,
 # so the endpoint for the login function you wrote above is 'auth.login' because you added it to the 'auth' blueprint.
+
+
+@click.command('calibrate-password-hash')
+@click.option('--target-ms', default=250, show_default=True, help='How long one hash should take, in milliseconds.')
+@with_appcontext
+def calibrate_password_hash_command(target_ms):
+    # Time a short hash a few times, then scale the iteration count linearly to the target time.
+    sample_iterations = 20000
+    method = f"{current_app.config['PASSWORD_HASH_METHOD']}:{sample_iterations}"
+    timings = []
+    for _ in range(5):
+        start = time.perf_counter()
+        generate_password_hash('calibration', method)
+        timings.append(time.perf_counter() - start)
+
+    per_iteration = statistics.median(timings) / sample_iterations
+    iterations = max(1000, round(target_ms / 1000 / per_iteration, -3))
+    click.echo(f'PASSWORD_HASH_ITERATIONS = {iterations:.0f}  # about {target_ms} ms per hash on this host')
+
+
+def init_app(app):
+    app.extensions['portfolio_user_cache'] = TTLCache(
+        app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL']
+    )
+    app.extensions['portfolio_hasher'] = Hasher(
+        app.config['PASSWORD_HASH_WORKERS'] or os.cpu_count(),
+        app.config['PASSWORD_HASH_MAX_QUEUED'],
+        app.config['PASSWORD_HASH_RETRY_AFTER'],
+    )
+    app.cli.add_command(calibrate_password_hash_command)
@@ -1,25 +1,327 @@
-from flask import Blueprint, flash, g, redirect, render_template, request, url_for
+import re
+from datetime import datetime
+
+from flask import (
+    Blueprint, current_app, flash, g, make_response, redirect, render_template, request, session, stream_with_context,
+    url_for
+)
+from markupsafe import Markup, escape
 from werkzeug.exceptions import abort
+from werkzeug.http import is_resource_modified
 from portfolio.auth import login_required
+from portfolio.cache import get_cache
+from portfolio.compress import delete_cached_page
 from portfolio.db import get_db
+from portfolio.queries import execute
+from portfolio.writer import get_writer
 
 # Creates a Blueprint named 'auth'. Like the application object, the blueprint needs to know where it’s defined, so __name__ is passed as the second argument.
 # The url_prefix will be prepended to all the URLs associated with the blueprint.
 bp = Blueprint('blog', __name__)
 
-# The index will show all of the posts, most recent first.
-# JOIN is used so that the author info from the user table is available in the result.
+# A cursor marks a position in the (created, id) ordering of posts.
+# It is the created timestamp and id of a post joined by '~', e.g. '2018-01-01 00:00:00~1'.
+def make_cursor(post):
+    # str() of a datetime matches the text SQLite stores for the created column, so the two compare correctly.
+    return f"{post['created']}~{post['id']}"
+
+
+def parse_cursor(cursor):
+    created, _, id = cursor.rpartition('~')
+
+    try:
+        return str(datetime.fromisoformat(created)), parse_id(id)
+    except ValueError:
+        abort(400, f'Invalid page cursor {cursor!r}.')
+
+
+# Parses the id in a cursor, which has to fit in an SQLite INTEGER to be bound as a parameter.
+def parse_id(id):
+    id = int(id)
+    if not -2 ** 63 <= id < 2 ** 63:
+        raise ValueError(f'Id {id} is out of range.')
+    return id
+
+
+# One page of the index. Iterating over it yields the posts, newest first.
+# The posts are read from the database cursor while the template loops over them, so a page never has to be held
+# in memory as a whole. That also means the older/newer cursors are only known once the posts have been iterated,
+# which is fine since the page navigation comes after the posts.
+# `cursor` makes the cursor of a post, for pages that aren't ordered by (created, id).
+class PostsPage(object):
+    def __init__(self, posts, per_page, has_newer, has_older=None, cursor=make_cursor):
+        self._posts = posts
+        self._cursor = cursor
+        self.per_page = per_page
+        self.has_newer = has_newer
+        # None means there is another page if `posts` has a row beyond `per_page`.
+        self.has_older = has_older
+        self.first = None
+        self.last = None
+
+    def __iter__(self):
+        for n, post in enumerate(self._posts):
+            if n == self.per_page:
+                if self.has_older is None:
+                    self.has_older = True
+                return
+            if self.first is None:
+                self.first = post
+            self.last = post
+            yield post
+
+    @property
+    def newer_cursor(self):
+        return self._cursor(self.first) if self.first is not None and self.has_newer else None
+
+    @property
+    def older_cursor(self):
+        return self._cursor(self.last) if self.last is not None and self.has_older else None
+
+
+# Posts are paged by keyset instead of OFFSET: each page seeks straight to the cursor through the (created, id) index,
+# so a page deep in the history costs the same as the first one.
+# Passing `older` returns the posts after that cursor, passing `newer` returns the posts before it.
+# Passing `author_id` pages through that author's posts only, with the author_posts queries.
+def get_posts_page(older=None, newer=None, per_page=None, author_id=None):
+    if per_page is None:
+        per_page = current_app.config['POSTS_PER_PAGE']
+
+    prefix, filters = ('author_posts', (author_id,)) if author_id is not None else ('posts', ())
+
+    # One extra row is read to find out if there is another page after this one without a COUNT query.
+    if newer is not None:
+        posts = execute(get_db(), f'{prefix}_newer_page', filters + parse_cursor(newer) + (per_page + 1,)).fetchall()
+        # Newer pages are read in ascending order to seek from the cursor, so they are read whole and flipped back to newest first.
+        # They are never longer than a page.
+        return PostsPage(reversed(posts[:per_page]), per_page, has_newer=len(posts) > per_page, has_older=True)
+
+    if older is not None:
+        posts = execute(get_db(), f'{prefix}_older_page', filters + parse_cursor(older) + (per_page + 1,))
+    else:
+        posts = execute(get_db(), f'{prefix}_first_page', filters + (per_page + 1,))
+    return PostsPage(posts, per_page, has_newer=older is not None)
+
+
+# Search results are ordered by rank and then id, so their cursor is the rank and id of a post joined by '~'.
+# repr() of a float reads back as exactly the same float.
+def make_search_cursor(post):
+    return f"{post['rank']!r}~{post['id']}"
+
+
+def parse_search_cursor(cursor):
+    rank, _, id = cursor.rpartition('~')
+
+    try:
+        return float(rank), parse_id(id)
+    except ValueError:
+        abort(400, f'Invalid page cursor {cursor!r}.')
+
+
+CONTROL_CHARACTERS = re.compile(r'[\x00-\x1f\x7f]')
+
+
+# Turns what a visitor typed into an FTS5 query that finds the posts containing every word.
+# Each word is quoted so FTS5 syntax in it can't cause an error, and a word ending in * still matches as a prefix.
+# Control characters separate words instead: FTS5 can't take a NUL even in a quoted string, and the others never
+# appear in a post's words anyway.
+def make_match(q):
+    terms = []
+    for word in CONTROL_CHARACTERS.sub(' ', q).split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+# Returns the page of posts matching `q` after the `after` cursor, best matches first.
+# The full text index finds the matching posts without reading any others, so searching costs about the same however many posts there are.
+def search_posts(q, after=None, per_page=None):
+    if per_page is None:
+        per_page = current_app.config['POSTS_PER_PAGE']
+
+    match = make_match(q)
+    if not match:
+        return None
+
+    if after is not None:
+        posts = execute(get_db(), 'search_posts_next_page', (match,) + parse_search_cursor(after) + (per_page + 1,))
+    else:
+        posts = execute(get_db(), 'search_posts_first_page', (match, per_page + 1))
+    return PostsPage(posts, per_page, has_newer=False, cursor=make_search_cursor)
+
+
+# Escapes a search snippet and marks the matching words in it.
+@bp.app_template_filter('highlight')
+def highlight(snippet):
+    return escape(snippet).replace('\x02', Markup('<mark>')).replace('\x03', Markup('</mark>'))
+
+
+# Renders a template piece by piece as the client reads the response, instead of building the whole page in memory first.
+# The page header and navigation reach the client before the posts are even read from the database.
+def stream_template(template_name, **context):
+    current_app.update_template_context(context)
+    stream = current_app.jinja_env.get_template(template_name).stream(context)
+    # Group the template's small pieces of output into fewer, larger writes.
+    if current_app.config['STREAM_BUFFER_SIZE'] > 1:
+        stream.enable_buffering(current_app.config['STREAM_BUFFER_SIZE'])
+    return stream
+
+
+# Returns the excerpt, length, word count and whether the excerpt is cut short, in the order of the post table's columns.
+# The excerpt is the start of the body, cut at a word boundary when the body is longer than POST_EXCERPT_LENGTH.
+def summarize_body(body):
+    length = current_app.config['POST_EXCERPT_LENGTH']
+    excerpt = body
+    truncated = len(body) > length
+    if truncated:
+        excerpt = body[:length]
+        # Drop the last word if the cut went through the middle of it, unless it is the only word.
+        if not body[length].isspace():
+            excerpt = re.sub(r'\S*$', '', excerpt) or excerpt
+        excerpt = excerpt.rstrip() + '\u2026'
+    return excerpt, len(body), len(body.split()), int(truncated)
+
+
+# Runs the post write `name` from portfolio.queries and commits it, either right away or with GROUP_COMMIT in the next
+# batch of the writer thread. Either way it has been committed, or has raised an error, when this returns.
+def write_post(name, parameters):
+    if current_app.config['GROUP_COMMIT']:
+        return get_writer().submit(name, parameters)
+
+    db = get_db()
+    id = execute(db, name, parameters).lastrowid
+    db.commit()
+    return id
+
+
+# Called after a change to the posts is committed, to drop every cached page that could show the old data.
+# `author_id` is the author of the post, whose author pages go too,
+# and `post` is the post as it was before it was edited or deleted, whose own page goes as well.
+# Other processes never serve these pages either, since they are cached under versions that have now changed,
+# but dropping them here frees the space for live pages instead of waiting for them to be evicted.
+def posts_changed(author_id, post=None):
+    get_cache().clear('index')
+    get_cache().clear(author_namespace(author_id))
+    if post is not None:
+        delete_cached_page('post', f"{post['id']}|{post['revision']}")
 
 
+# Each author's pages are cached in a namespace of their own, under the author's posts_version,
+# so a post only changes the keys of its own author's pages and the other authors' cached pages are still served.
+def author_namespace(author_id):
+    return f'author-{author_id}'
+
+
+# Starts a read transaction that stays open for the rest of the request and returns the connection.
+# A version read in it and the posts read after it come from the same snapshot of the database, so the validators and
+# cache key made from the version describe exactly the page that is sent. With WAL, the open read transaction doesn't hold up writers.
+def begin_read():
+    db = get_db()
+    if not db.in_transaction:
+        db.execute('BEGIN')
+    return db
+
+
+# Answers a conditional GET before any posts are read or templates rendered.
+# Returns a 304 response if the client's copy is still current, otherwise None.
+# Pages carrying flashed messages are one-offs, so they are always sent in full.
+def check_not_modified(etag, modified):
+    if '_flashes' in session or is_resource_modified(request.environ, etag=etag, last_modified=modified):
+        return None
+    return add_validators(make_response('', 304), etag, modified)
+
+
+def add_validators(response, etag, modified):
+    response.set_etag(etag)
+    response.last_modified = modified
+    # The page is different for each logged in user, and clients have to revalidate before reusing their copy.
+    response.vary.add('Cookie')
+    response.cache_control.no_cache = True
+    return response
+
+
+# The index will show one page of posts, most recent first.
+# The post_version row changes with every post write.
 @bp.route('/')
 def index():
-    db = get_db()
-    posts = db.execute(
-        'SELECT p.id, title, body, created, author_id, username'
-        ' FROM post p JOIN user u ON p.author_id = u.id'
-        ' ORDER BY created DESC'
-    ).fetchall()
-    return render_template('blog/index.html', posts=posts)
+    version = execute(begin_read(), 'post_version').fetchone()
+    return show_posts_page('index', 'blog/index.html', version['version'], version['modified'])
+
+
+# Lists one author's posts, paged and cached like the index.
+@bp.route('/author/<username>')
+def author(username):
+    # The author is read with their posts_version, in the same snapshot as the page of posts.
+    author = execute(begin_read(), 'author_by_username', (username,)).fetchone()
+
+    if author is None:
+        abort(404, f'User {username} doesn\'t exist.')
+
+    return show_posts_page(
+        author_namespace(author['id']), 'blog/author.html', author['posts_version'], author['posts_modified'],
+        author_id=author['id'], author=author
+    )
+
+
+# Responds with the page of posts the request's older/newer cursor points at, rendered with `template_name`.
+# `version` and `modified` are the version of the posts on the page and when it last changed, read with begin_read().
+# They make the ETag and Last-Modified values, and pages are cached in `namespace` under the version.
+# The page also depends on who is logged in.
+def show_posts_page(namespace, template_name, version, modified, author_id=None, **context):
+    user = g.user['id'] if g.user is not None else 0
+    etag = f'{namespace}-{version}-{user}'
+    response = check_not_modified(etag, modified)
+    if response is not None:
+        return response
+
+    older = request.args.get('older')
+    newer = request.args.get('newer')
+    # Every logged-out visitor sees the same page, unless there are flashed messages waiting to be shown,
+    # so it is rendered once and served from the page cache until a post changes.
+    # The version in the key means a page cached before a write to its posts is never served after it, even by a process
+    # whose cache posts_changed() didn't clear. The cursors are parsed, so different ways of writing one share a key.
+    cacheable = g.user is None and '_flashes' not in session
+    key = f'{version}|{cursor_key(older)}|{cursor_key(newer)}'
+
+    html = get_cache().get(namespace, key) if cacheable else None
+
+    if html is None:
+        page = get_posts_page(older, newer, author_id=author_id)
+
+        if current_app.config['INDEX_STREAMING']:
+            chunks = stream_template(template_name, page=page, **context)
+            if cacheable:
+                chunks = cache_when_done(chunks, namespace, key)
+            # stream_with_context keeps the request, and with it the database connection, open while the page is sent.
+            return add_validators(current_app.response_class(stream_with_context(chunks)), etag, modified)
+
+        html = render_template(template_name, page=page, **context).encode('utf8')
+
+        if cacheable:
+            get_cache().set(namespace, key, html)
+
+    if cacheable:
+        g.page_cache_key = (namespace, key)
+    return add_validators(make_response(html), etag, modified)
+
+
+def cursor_key(cursor):
+    if cursor is None:
+        return None
+    created, id = parse_cursor(cursor)
+    return f'{created}~{id}'
+
+
+# Passes a streamed page through to the client while keeping a copy, which goes into the page cache once the page is complete.
+def cache_when_done(chunks, namespace, key):
+    sent = []
+    for chunk in chunks:
+        chunk = chunk.encode('utf8')
+        sent.append(chunk)
+        yield chunk
+    get_cache().set(namespace, key, b''.join(sent))
 
 
 # The create view works the same as the auth register view.
@@ -35,18 +337,13 @@ def create():
 
         # If missing title throw error
         if not title:
-            erro - 'Title is required'
+            error = 'Title is required.'
 
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
-                'INSERT INTO post (title, body, author_id)'
-                ' VALUES (?, ?, ?)',
-                (title, body, g.user['id'])
-            )
-            db.commit()
+            write_post('insert_post', (title, body) + summarize_body(body) + (g.user['id'],))
+            posts_changed(g.user['id'])
             return redirect(url_for('blog.index'))
 
     return render_template('blog/create.html')
@@ -55,12 +352,7 @@ def create():
 
 
 def get_post(id, check_author=True):
-    post = get_db().execute(
-        'SELECT p.id, title, body, created, author_id, username'
-        ' FROM post p JOIN user u ON p.author_id = u.id'
-        ' WHERE p.id = ?',
-        (id,)
-    ).fetchone()
+    post = execute(get_db(), 'post_by_id', (id,)).fetchone()
 
     if post is None:
         abort(404, f'Post id {id} doesn\'t exist.')
@@ -71,6 +363,48 @@ def get_post(id, check_author=True):
     return post
 
 
+@bp.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    page = search_posts(q, request.args.get('after')) if q else None
+    return render_template('blog/search.html', q=q, page=page)
+
+
+# Shows a whole post. This is the only page that reads a post's full body, the index only shows excerpts.
+# Logged-out visitors all see the same page, so it is rendered once and then served from the page cache
+# without any template work, and with only the lookup of the post's revision, until the post is edited or deleted.
+@bp.route('/<int:id>')
+def detail(id):
+    cacheable = g.user is None and '_flashes' not in session
+    key = post_cache_key(id) if cacheable else None
+
+    html = get_cache().get('post', key) if key is not None else None
+
+    if html is None:
+        html = render_template('blog/detail.html', post=get_post(id, check_author=False)).encode('utf8')
+
+        if key is not None:
+            get_cache().set('post', key, html)
+
+    if key is not None:
+        g.page_cache_key = ('post', key)
+
+    # The ETag is a hash of the page, so it changes whenever the post does.
+    response = make_response(html)
+    response.add_etag()
+    response.vary.add('Cookie')
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+# Post pages are cached under the post's revision, which the post_revision trigger bumps whenever the post changes.
+# A page cached before an edit is never served after it, even by a process whose cache posts_changed() didn't clear.
+# Returns None if there is no such post.
+def post_cache_key(id):
+    post = execute(begin_read(), 'post_revision', (id,)).fetchone()
+    return f"{id}|{post['revision']}" if post is not None else None
+
+
 # The update function takes an argument, id.
 # That corresponds to the <int:id> in the route.
 # A real URL will look like /1/update. Flask will capture the 1, ensure it’s an int, and pass it as the id argument.
@@ -91,13 +425,8 @@ def update(id):
         if error is not None:
             flash(error)
         else:
-            db.get_db()
-            db.execute(
-                'UPDATE post SET title = ?, body = ?'
-                ' WHERE id = ?',
-                (title, body, id)
-            )
-            db.commit()
+            write_post('update_post', (title, body) + summarize_body(body) + (id,))
+            posts_changed(g.user['id'], post)
             return redirect(url_for('blog.index'))
 
     return render_template('blog/update.html', post=post)
@@ -108,8 +437,7 @@ def update(id):
 @bp.route('/<int:id>/delete', methods=('POST',))
 @login_required
 def delete(id):
-    get_post(id)
-    db = get_db()
-    db.execute('DELETE FROM post WHERE id = ?', (id,))
-    db.commit()
+    post = get_post(id)
+    write_post('delete_post', (id,))
+    posts_changed(g.user['id'], post)
     return redirect(url_for('blog.index'))
@@ -0,0 +1,237 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+# The page cache stores rendered pages as bytes under a (namespace, key) pair.
+# A namespace groups the pages that are invalidated together, e.g. all the pages of the blog index.
+
+
+# Keeps pages in a dict inside the process. Each worker process has its own copy.
+class MemoryCache(object):
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # OrderedDict keeps the least recently used page first, so eviction pops from the front.
+        self._pages = OrderedDict()
+        self._size = 0
+
+    def get(self, namespace, key):
+        with self._lock:
+            value = self._pages.get((namespace, key))
+            if value is not None:
+                self._pages.move_to_end((namespace, key))
+            return value
+
+    def set(self, namespace, key, value):
+        # A page that could never fit would only empty the cache.
+        if len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._pages.pop((namespace, key), None)
+            if old is not None:
+                self._size -= len(old)
+            self._pages[(namespace, key)] = value
+            self._size += len(value)
+
+            while self._size > self.max_bytes:
+                _, evicted = self._pages.popitem(last=False)
+                self._size -= len(evicted)
+
+    def delete(self, namespace, key):
+        with self._lock:
+            old = self._pages.pop((namespace, key), None)
+            if old is not None:
+                self._size -= len(old)
+
+    def clear(self, namespace=None):
+        with self._lock:
+            for page in [page for page in self._pages if namespace is None or page[0] == namespace]:
+                self._size -= len(self._pages.pop(page))
+
+
+# Keeps pages as files in a directory, one subdirectory per namespace.
+# All the worker processes on a host share it, so a write in one process invalidates the pages for all of them.
+class FileCache(object):
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # The size of the cached pages as this process last counted it, plus what it has written and removed since.
+        # The directory is only scanned when this goes over max_bytes, instead of on every set().
+        # Other processes' writes aren't included, so the directory can grow past max_bytes until one of them scans it.
+        self._size = None
+
+    def _path(self, namespace, key):
+        return os.path.join(self.directory, namespace, hashlib.sha1(key.encode('utf8')).hexdigest())
+
+    def get(self, namespace, key):
+        path = self._path(namespace, key)
+
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            # The modification time doubles as the last use time for LRU eviction.
+            os.utime(path)
+        except OSError:
+            return None
+
+        return value
+
+    def set(self, namespace, key, value):
+        if len(value) > self.max_bytes:
+            return
+
+        path = self._path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Pages are written to a temporary file and renamed into place, so readers never see half a page.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+        old_size = self._file_size(path)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is not None:
+                self._size += len(value) - old_size
+            over = self._size is None or self._size > self.max_bytes
+        if over:
+            self._evict()
+
+    def delete(self, namespace, key):
+        self._remove(self._path(namespace, key))
+
+    def clear(self, namespace=None):
+        namespaces = [namespace] if namespace is not None else self._namespaces()
+
+        for namespace in namespaces:
+            for entry in self._entries(namespace):
+                self._remove(entry.path)
+
+    def _file_size(self, path):
+        try:
+            return os.stat(path).st_size
+        except OSError:
+            return 0
+
+    def _remove(self, path):
+        size = self._file_size(path)
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size -= size
+
+    def _namespaces(self):
+        return [entry.name for entry in os.scandir(self.directory) if entry.is_dir()]
+
+    def _entries(self, namespace):
+        try:
+            return list(os.scandir(os.path.join(self.directory, namespace)))
+        except OSError:
+            return []
+
+    def _evict(self):
+        pages = []
+        for namespace in self._namespaces():
+            for entry in self._entries(namespace):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                pages.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(page[1] for page in pages)
+        for _, page_size, path in sorted(pages):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= page_size
+
+        with self._lock:
+            self._size = size
+
+
+# Used when PAGE_CACHE_BACKEND is None, so callers don't need to check whether caching is on.
+class NullCache(object):
+    def get(self, namespace, key):
+        return None
+
+    def set(self, namespace, key, value):
+        pass
+
+    def delete(self, namespace, key):
+        pass
+
+    def clear(self, namespace=None):
+        pass
+
+
+# A small in-process cache of objects that go stale after `ttl` seconds, holding at most `max_entries` of them.
+# Used for data that is read on every request but rarely changes, like the logged in user.
+class TTLCache(object):
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # Maps each key to (expiry time, value), least recently used first.
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+BACKENDS = {
+    'memory': lambda app: MemoryCache(app.config['PAGE_CACHE_MAX_BYTES']),
+    'file': lambda app: FileCache(
+        app.config['PAGE_CACHE_DIR'] or os.path.join(app.instance_path, 'page_cache'),
+        app.config['PAGE_CACHE_MAX_BYTES'],
+    ),
+    None: lambda app: NullCache(),
+}
+
+
+def get_cache():
+    return current_app.extensions['portfolio_page_cache']
+
+
+def init_app(app):
+    # PAGE_CACHE_BACKEND is either the name of one of the BACKENDS or a function that takes the app and returns a cache.
+    backend = app.config['PAGE_CACHE_BACKEND']
+    if not callable(backend):
+        backend = BACKENDS[backend]
+    app.extensions['portfolio_page_cache'] = backend(app)
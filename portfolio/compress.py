@@ -0,0 +1,109 @@
+import zlib
+
+from flask import current_app, g, request
+
+from portfolio.cache import get_cache
+
+# The wbits that make zlib write each Content-Encoding's format: gzip has a gzip header, HTTP's deflate is the zlib format.
+ENCODINGS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+def make_compressor(encoding):
+    return zlib.compressobj(current_app.config['COMPRESS_LEVEL'], zlib.DEFLATED, ENCODINGS[encoding])
+
+
+# Views that send a page from the page cache set g.page_cache_key to the page's (namespace, key).
+# Its compressed variants are cached next to it, under the page's key and the encoding, so a page served from the cache
+# isn't compressed again on every request. They go when the page's namespace is cleared, like the page.
+def compress_page(data, encoding):
+    cached = g.get('page_cache_key')
+    if cached is not None:
+        namespace, key = cached
+        compressed = get_cache().get(namespace, f'{key}|{encoding}')
+        if compressed is not None:
+            return compressed
+
+    compressor = make_compressor(encoding)
+    compressed = compressor.compress(data) + compressor.flush()
+
+    if cached is not None:
+        get_cache().set(namespace, f'{key}|{encoding}', compressed)
+    return compressed
+
+
+# Drops a page from the page cache together with its compressed variants.
+def delete_cached_page(namespace, key):
+    get_cache().delete(namespace, key)
+    for encoding in ENCODINGS:
+        get_cache().delete(namespace, f'{key}|{encoding}')
+
+
+# Compresses a streamed response one piece at a time.
+# Each piece is flushed, so the client still gets the start of the page while the rest is being rendered.
+def compress_stream(response, compressor):
+    chunks = response.iter_encoded()
+    original = response.response
+
+    def generate():
+        try:
+            for chunk in chunks:
+                data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                    yield data
+            yield compressor.flush()
+        finally:
+            # The response now closes this generator instead of the original iterable, which may need closing too.
+            if hasattr(original, 'close'):
+                original.close()
+
+    return generate()
+
+
+def compress_response(response):
+    config = current_app.config
+    if not config['COMPRESS_RESPONSES']:
+        return response
+
+    # Files are left alone: the static files are precompressed by `flask build-assets`, and those variants already have a
+    # Content-Encoding. Responses without a body, partial content and responses that mustn't be transformed are skipped too.
+    if (
+        response.direct_passthrough
+        or 'Content-Encoding' in response.headers
+        or 'Content-Range' in response.headers
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or response.cache_control.no_transform
+        or response.mimetype not in config['COMPRESS_MIMETYPES']
+    ):
+        return response
+
+    # Whether this response is compressed depends on the request's Accept-Encoding, so caches must keep them apart.
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(list(ENCODINGS))
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response, make_compressor(encoding))
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        # Below this size the compression saves too little to be worth the time.
+        if len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compress_page(data, encoding))
+
+    response.headers['Content-Encoding'] = encoding
+    # The compressed bytes differ from the uncompressed ones, so a strong ETag would be wrong for them.
+    # A weak ETag still matches the If-None-Match the views check, since that comparison is weak.
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
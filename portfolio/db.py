@@ -1,29 +1,332 @@
+import calendar
+import itertools
+import json
+import logging
+import os
+import random
+import re
 import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
 
 import click
-from flask import current_app, g
+from flask import current_app, g, request
 from flask.cli import with_appcontext
 
+# Slow queries are logged here as one JSON object per line, so log tooling can parse them.
+slow_query_logger = logging.getLogger('portfolio.db.slow_queries')
+
+
+def apply_pragmas(db, pragmas):
+    # PRAGMA values can't be bound as parameters. They come from the app config, never from a request.
+    for name, value in pragmas.items():
+        db.execute(f'PRAGMA {name} = {value}').fetchall()
+
+
+class Connection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Names of the portfolio.queries statements that have been prepared on this connection.
+        self.prepared_queries = set()
+
+
+def connect(database, pragmas=None, cached_statements=256):
+    # sqlite3.connect() establishes a connection to the file pointed at by the DATABASE configuration key.
+    # Pooled connections are handed from thread to thread, so sqlite3's same-thread check is turned off.
+    # The pool makes sure only one request uses a connection at a time.
+    db = sqlite3.connect(
+        database,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        check_same_thread=False,
+        # Prepared statements kept per connection. Pooled connections live long, so the queries the views run are prepared once.
+        cached_statements=cached_statements,
+        factory=Connection,
+    )
+    # sqlite3.Row tells the connection to return rows that behave like dicts. This allows accessing the columns by name.
+    db.row_factory = sqlite3.Row
+    # The SQLITE_PRAGMAS profile is applied once, when the connection is opened, and stays in effect while it is pooled.
+    apply_pragmas(db, pragmas or {})
+    return db
+
+
+# Rows for read-heavy views, an opt-in alternative to sqlite3.Row.
+# They are plain tuples with the columns as properties, so building one costs about as much as building the tuple,
+# and `row['title']` and `row.title` both work in templates.
+# Timestamp columns are selected as text (see portfolio.queries) and only parsed into a datetime when they are read,
+# so a page that never formats a date never pays for parsing one.
+class FastRow(tuple):
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key.__class__ is str:
+            return getattr(self, key)
+        return getattr(self, self._fields[key])
+
+    def keys(self):
+        return list(self._fields)
+
+
+# Columns that hold timestamps, parsed lazily by FastRow.
+TIMESTAMP_COLUMNS = {'created', 'modified'}
+
+_fast_row_classes = {}
+
+
+def fast_row_class(fields):
+    cls = _fast_row_classes.get(fields)
+
+    if cls is None:
+        namespace = {'__slots__': (), '_fields': fields}
+        for i, name in enumerate(fields):
+            if name in TIMESTAMP_COLUMNS:
+                namespace[name] = property(lambda row, i=i: datetime.fromisoformat(tuple.__getitem__(row, i)))
+            else:
+                namespace[name] = property(lambda row, i=i: tuple.__getitem__(row, i))
+        cls = _fast_row_classes[fields] = type('FastRow', (FastRow,), namespace)
+
+    return cls
+
+
+# A row factory for one cursor. The row class is looked up once, from the first row's column names.
+class FastRowFactory(object):
+    def __init__(self):
+        self.row_class = None
+
+    def __call__(self, cursor, values):
+        if self.row_class is None:
+            self.row_class = fast_row_class(tuple(column[0] for column in cursor.description))
+        return self.row_class(values)
+
+
+# The connection handed out by the pool. It behaves like the sqlite3 connection it wraps,
+# but close() gives the connection back to the pool, and using it after that fails the same way a closed connection does.
+class PooledConnection(object):
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name):
+        if self._connection is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return getattr(self._connection, name)
+
+    def __enter__(self):
+        return self.__getattr__('__enter__')()
+
+    def __exit__(self, *exc_info):
+        return self.__getattr__('__exit__')(*exc_info)
+
+    def close(self):
+        connection, self._connection = self._connection, None
+
+        if connection is not None:
+            self._pool.checkin(connection)
+
+
+# A pooled connection that times every statement run through it, for the requests picked by QUERY_SAMPLE_RATE.
+# Each statement is appended to `queries` as a [sql, seconds] pair.
+class InstrumentedConnection(PooledConnection):
+    def __init__(self, pool, connection, queries):
+        super().__init__(pool, connection)
+        self._queries = queries
+
+    def _timed(self, method, sql, *args):
+        query = [sql, 0.0]
+        self._queries.append(query)
+        start = time.perf_counter()
+        try:
+            cursor = self.__getattr__(method)(sql, *args)
+        finally:
+            query[1] += time.perf_counter() - start
+        return InstrumentedCursor(cursor, query)
+
+    def execute(self, sql, parameters=()):
+        return self._timed('execute', sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed('executemany', sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self._timed('executescript', script)
+
+
+# SQLite does most of the work of a SELECT while its rows are fetched, so fetching is timed too,
+# and added to the time of the statement the cursor belongs to.
+class InstrumentedCursor(object):
+    def __init__(self, cursor, query):
+        self._cursor = cursor
+        self._query = query
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    @property
+    def row_factory(self):
+        return self._cursor.row_factory
+
+    @row_factory.setter
+    def row_factory(self, row_factory):
+        self._cursor.row_factory = row_factory
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return getattr(self._cursor, method)(*args)
+        finally:
+            self._query[1] += time.perf_counter() - start
+
+    def fetchone(self):
+        return self._timed('fetchone')
+
+    def fetchmany(self, *args):
+        return self._timed('fetchmany', *args)
+
+    def fetchall(self):
+        return self._timed('fetchall')
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._timed('__next__')
+
+
+# A bounded pool of connections to one database file, shared by all the threads of a process.
+# Reusing connections means requests don't pay for opening the file and warming SQLite's page cache each time.
+class ConnectionPool(object):
+    def __init__(self, database, pragmas=None, max_size=8, timeout=5.0, check_interval=30.0, cached_statements=256):
+        self.database = database
+        self.pragmas = pragmas or {}
+        self.cached_statements = cached_statements
+        self.max_size = max_size
+        self.timeout = timeout
+        # Idle connections older than this many seconds are checked with a cheap query before being handed out again.
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        # Idle connections as (connection, id of the thread that last used it, time it was returned), most recent last.
+        self._idle = []
+        self._pid = os.getpid()
+
+    # Passing a list for `queries` returns an InstrumentedConnection that records its statements in it.
+    def checkout(self, queries=None):
+        # Connections can't be shared with a forked child process, so a worker forked after the pool was used starts over.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = []
+            self._slots = threading.BoundedSemaphore(self.max_size)
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError(
+                f'No database connection became free within {self.timeout} seconds.'
+            )
+
+        try:
+            connection = self._take_idle()
+            if connection is None:
+                connection = connect(self.database, self.pragmas, self.cached_statements)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        if queries is not None:
+            return InstrumentedConnection(self, connection, queries)
+        return PooledConnection(self, connection)
+
+    def checkin(self, connection):
+        try:
+            # Work a request left uncommitted must not leak into the next request that gets this connection.
+            if connection.in_transaction:
+                connection.rollback()
+        except sqlite3.Error:
+            connection.close()
+        else:
+            with self._lock:
+                self._idle.append((connection, threading.get_ident(), time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def _take_idle(self):
+        thread = threading.get_ident()
+
+        with self._lock:
+            if not self._idle:
+                return None
+
+            # Prefer the connection this thread used last, since its pages are most likely still in the CPU cache.
+            # Otherwise take the most recently returned one, whose SQLite page cache is the warmest.
+            for i in range(len(self._idle) - 1, -1, -1):
+                if self._idle[i][1] == thread:
+                    break
+            else:
+                i = len(self._idle) - 1
+            connection, _, returned = self._idle.pop(i)
+
+        if time.monotonic() - returned > self.check_interval:
+            try:
+                connection.execute('SELECT 1').fetchone()
+            except sqlite3.Error:
+                connection.close()
+                return None
+
+        return connection
+
+    def close(self):
+        # Closes the idle connections. Connections that are checked out are closed when they are returned.
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for connection, _, _ in idle:
+            connection.close()
+
+
+def get_pool(app=None):
+    if app is None:
+        app = current_app
+    return app.extensions['portfolio_db_pool']
+
 
 def get_db():
     # `g` is a special object that is unique for each request. It is used to store data that might be accessed by multiple functions during the request.
-    # The connection is stored and reused instead of creating a new connection if `get_db` is called a second time in the same request.
+    # The connection is stored and reused instead of checking out another connection if `get_db` is called a second time in the same request.
     if 'db' not in g:
-        # sqlite3.connect() establishes a connection to the file pointed at by the DATABASE configuration key.
-        g.db = sqlite3.connect(
-            # `current_app` is another special object that points to the Flask application handling the request.
-            # Because we used an application factory, there is no application object when writing the rest of your code.
-            # `get_db` will be called when the application has been created and is handling a request, so current_app can be used.
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES,
-        )
-        # sqlite3.Row tells the connection to return rows that behave like dicts. This allows accessing the columns by name.
-        g.db.row_factory = sqlite3.Row
+        # `current_app` is another special object that points to the Flask application handling the request.
+        # Because we used an application factory, there is no application object when writing the rest of your code.
+        # `get_db` will be called when the application has been created and is handling a request, so current_app can be used.
+        # A sample of requests get an instrumented connection. Timing every statement is cheap, but not free.
+        if random.random() < current_app.config['QUERY_SAMPLE_RATE']:
+            g.queries = []
+        g.db = get_pool().checkout(g.get('queries'))
     return g.db
 
 
+# Reports the statements timed during a sampled request in a Server-Timing header, which browser dev tools show,
+# and logs the ones slower than SLOW_QUERY_MS.
+def report_queries(response):
+    queries = g.get('queries')
+    if queries is None:
+        return response
+
+    total = sum(seconds for _, seconds in queries)
+    response.headers.add('Server-Timing', f'db;dur={total * 1000:.3f};desc="{len(queries)} queries"')
+
+    threshold = current_app.config['SLOW_QUERY_MS'] / 1000
+    for sql, seconds in queries:
+        if seconds >= threshold:
+            slow_query_logger.warning(json.dumps({
+                'event': 'slow_query',
+                'ms': round(seconds * 1000, 3),
+                'sql': ' '.join(sql.split()),
+                'method': request.method,
+                'path': request.path,
+            }))
+
+    return response
+
+
 def close_db(e=None):
-    # Close_db checks if a connection was created by checking if g.db was set. If the connection exists, it is closed.
+    # Close_db checks if a connection was checked out by checking if g.db was set. If it was, it is returned to the pool.
 
     db = g.pop('db', None)
 
@@ -31,6 +334,166 @@ def close_db(e=None):
         db.close()
 
 
+# Migration 3: adds the columns that summarize each post and fills them in from the existing bodies.
+# It has its own copy of the summarizer as it was when the migration was written, so what it does never changes
+# with the blog's summarize_body() or the POST_EXCERPT_LENGTH setting.
+def add_post_summaries(db):
+    def summarize_body(body, length=300):
+        excerpt = body
+        if len(body) > length:
+            excerpt = body[:length]
+            if not body[length].isspace():
+                excerpt = re.sub(r'\S*$', '', excerpt) or excerpt
+            excerpt = excerpt.rstrip() + '\u2026'
+        return excerpt, len(body), len(body.split())
+
+    db.execute("ALTER TABLE post ADD COLUMN excerpt TEXT NOT NULL DEFAULT ''")
+    db.execute('ALTER TABLE post ADD COLUMN body_length INTEGER NOT NULL DEFAULT 0')
+    db.execute('ALTER TABLE post ADD COLUMN word_count INTEGER NOT NULL DEFAULT 0')
+
+    # Posts are summarized a thousand at a time, so a large table never has to be held in memory.
+    last = 0
+    while True:
+        posts = db.execute('SELECT id, body FROM post WHERE id > ? ORDER BY id LIMIT 1000', (last,)).fetchall()
+        if not posts:
+            break
+        db.executemany(
+            'UPDATE post SET excerpt = ?, body_length = ?, word_count = ? WHERE id = ?',
+            (summarize_body(body) + (id,) for id, body in posts)
+        )
+        last = posts[-1]['id']
+
+
+# Each migration upgrades a database from the version that is its position in the list to the next one.
+# The version a database is at is kept in SQLite's user_version header field.
+# schema.sql always creates the latest version, so a change to it needs a matching migration here and the other way around.
+MIGRATIONS = [
+    # 1: indexes for paging the blog index and for looking up posts by author.
+    '''
+    CREATE INDEX IF NOT EXISTS post_created_idx ON post (created, id);
+    CREATE INDEX IF NOT EXISTS post_author_idx ON post (author_id);
+    ''',
+    # 2: the post_version row and the triggers that keep it current.
+    '''
+    CREATE TABLE post_version (
+      id INTEGER PRIMARY KEY CHECK (id = 1),
+      version INTEGER NOT NULL,
+      modified TIMESTAMP NOT NULL
+    );
+    INSERT INTO post_version (id, version, modified) VALUES (1, 0, CURRENT_TIMESTAMP);
+    CREATE TRIGGER post_insert_version AFTER INSERT ON post BEGIN
+      UPDATE post_version SET version = version + 1, modified = CURRENT_TIMESTAMP;
+    END;
+    CREATE TRIGGER post_update_version AFTER UPDATE ON post BEGIN
+      UPDATE post_version SET version = version + 1, modified = CURRENT_TIMESTAMP;
+    END;
+    CREATE TRIGGER post_delete_version AFTER DELETE ON post BEGIN
+      UPDATE post_version SET version = version + 1, modified = CURRENT_TIMESTAMP;
+    END;
+    ''',
+    # 3: the excerpt, body length and word count of each post, filled in for the existing posts.
+    add_post_summaries,
+    # 4: the full text index for searching posts, built from the existing posts, and the triggers that keep it current.
+    '''
+    CREATE VIRTUAL TABLE post_search USING fts5(
+      title, body, content='post', content_rowid='id', tokenize='porter unicode61'
+    );
+    INSERT INTO post_search (post_search, rank) VALUES ('rank', 'bm25(10.0, 1.0)');
+    INSERT INTO post_search (post_search) VALUES ('rebuild');
+    CREATE TRIGGER post_search_insert AFTER INSERT ON post BEGIN
+      INSERT INTO post_search (rowid, title, body) VALUES (new.id, new.title, new.body);
+    END;
+    CREATE TRIGGER post_search_update AFTER UPDATE OF title, body ON post BEGIN
+      INSERT INTO post_search (post_search, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+      INSERT INTO post_search (rowid, title, body) VALUES (new.id, new.title, new.body);
+    END;
+    CREATE TRIGGER post_search_delete AFTER DELETE ON post BEGIN
+      INSERT INTO post_search (post_search, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    END;
+    ''',
+    # 5: an index for paging through an author's posts, which also covers looking them up by author alone.
+    '''
+    CREATE INDEX post_author_created_idx ON post (author_id, created, id);
+    DROP INDEX post_author_idx;
+    ''',
+    # 6: the copy of the author's username on each post and the triggers that keep it current.
+    '''
+    ALTER TABLE post ADD COLUMN author_username TEXT;
+    UPDATE post SET author_username = (SELECT username FROM user WHERE id = post.author_id);
+    CREATE TRIGGER post_author_username AFTER INSERT ON post WHEN new.author_username IS NULL BEGIN
+      UPDATE post SET author_username = (SELECT username FROM user WHERE id = new.author_id) WHERE id = new.id;
+    END;
+    CREATE TRIGGER user_username_update AFTER UPDATE OF username ON user BEGIN
+      UPDATE post SET author_username = new.username WHERE author_id = new.id;
+    END;
+    ''',
+    # 7: the revision of each post and the trigger that bumps it.
+    '''
+    ALTER TABLE post ADD COLUMN revision INTEGER NOT NULL DEFAULT 0;
+    CREATE TRIGGER post_revision AFTER UPDATE ON post WHEN new.revision = old.revision BEGIN
+      UPDATE post SET revision = old.revision + 1 WHERE id = new.id;
+    END;
+    ''',
+    # 8: the table where import_posts() saves the indexes and triggers it drops.
+    '''
+    CREATE TABLE import_deferred (
+      name TEXT PRIMARY KEY,
+      sql TEXT NOT NULL
+    );
+    ''',
+    # 9: the version of each author's posts, which the post_version triggers now keep current too.
+    '''
+    ALTER TABLE user ADD COLUMN posts_version INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE user ADD COLUMN posts_modified TIMESTAMP;
+    UPDATE user SET posts_modified = CURRENT_TIMESTAMP;
+    DROP TRIGGER post_insert_version;
+    DROP TRIGGER post_update_version;
+    DROP TRIGGER post_delete_version;
+    CREATE TRIGGER post_insert_version AFTER INSERT ON post BEGIN
+      UPDATE post_version SET version = version + 1, modified = CURRENT_TIMESTAMP;
+      UPDATE user SET posts_version = posts_version + 1, posts_modified = CURRENT_TIMESTAMP WHERE id = new.author_id;
+    END;
+    CREATE TRIGGER post_update_version AFTER UPDATE ON post BEGIN
+      UPDATE post_version SET version = version + 1, modified = CURRENT_TIMESTAMP;
+      UPDATE user SET posts_version = posts_version + 1, posts_modified = CURRENT_TIMESTAMP
+        WHERE id IN (old.author_id, new.author_id);
+    END;
+    CREATE TRIGGER post_delete_version AFTER DELETE ON post BEGIN
+      UPDATE post_version SET version = version + 1, modified = CURRENT_TIMESTAMP;
+      UPDATE user SET posts_version = posts_version + 1, posts_modified = CURRENT_TIMESTAMP WHERE id = old.author_id;
+    END;
+    ''',
+    # 10: whether each post's excerpt is cut short, for the index's "Read all" link.
+    '''
+    ALTER TABLE post ADD COLUMN truncated INTEGER NOT NULL DEFAULT 0;
+    UPDATE post SET truncated = excerpt != body;
+    ''',
+]
+
+
+def migrate_db():
+    db = get_db()
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+
+    for version, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        # Each migration and its version bump commit together, so a failed migration leaves the database as it was.
+        # A migration is either an SQL script or a function that takes the connection, for changes SQL alone can't make.
+        try:
+            if callable(script):
+                db.execute('BEGIN')
+                script(db)
+                db.execute(f'PRAGMA user_version = {version}')
+                db.commit()
+            else:
+                db.executescript(f'BEGIN; {script}; PRAGMA user_version = {version}; COMMIT;')
+        except sqlite3.Error:
+            db.rollback()
+            raise
+
+    restore_deferred(db)
+    return version
+
+
 def init_db():
     db = get_db()
 
@@ -38,6 +501,15 @@ def init_db():
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf8'))
 
+    # The new schema is already the latest version, so there is nothing for migrate_db to do on it.
+    db.execute(f'PRAGMA user_version = {len(MIGRATIONS)}')
+
+    # The journal mode is stored in the database file itself, so setting it here makes every later connection use it,
+    # including ones opened by tools outside the app.
+    journal_mode = current_app.config['SQLITE_PRAGMAS'].get('journal_mode')
+    if journal_mode is not None:
+        apply_pragmas(db, {'journal_mode': journal_mode})
+
 
 @click.command('init-db')
 @with_appcontext
@@ -47,8 +519,294 @@ def init_db_command():
     click.echo('Initialized the database.')
 
 
+# Functions that pick a post body length around the average `mean`, for seed_db.
+BODY_LENGTHS = {
+    'fixed': lambda rng, mean: mean,
+    'uniform': lambda rng, mean: rng.randint(0, 2 * mean),
+    # Mostly short posts with a long tail of big ones, like real blogs.
+    'exponential': lambda rng, mean: int(rng.expovariate(1 / mean)) if mean else 0,
+}
+
+SEED_WORDS = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do',
+              'eiusmod', 'tempor', 'incididunt', 'ut', 'labore', 'et', 'dolore', 'magna', 'aliqua']
+
+
+# Adds `users` users and `posts` posts spread evenly over them, for trying the app out at a realistic scale.
+# The same `seed` always produces the same data. Every seeded user's password is `password`.
+def seed_db(users, posts, body_length=500, distribution='exponential', seed=0, batch_size=50000, password='password'):
+    from portfolio.auth import hash_password
+    from portfolio.blog import summarize_body
+
+    rng = random.Random(seed)
+    body_lengths = BODY_LENGTHS[distribution]
+    db = get_db()
+
+    # Bodies are slices of one long random text, which is much faster than building millions of bodies word by word.
+    # Words average over four characters with their space, so the text is longer than 20 times the average body,
+    # which is as long as a body gets.
+    text = ' '.join(rng.choice(SEED_WORDS) for _ in range(5 * body_length + 1))
+
+    def body():
+        length = min(body_lengths(rng, body_length), len(text))
+        start = rng.randrange(len(text) - length + 1)
+        return text[start:start + length]
+
+    # Users are numbered after the highest existing id so seeding an already seeded database doesn't clash.
+    first_user = db.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM user').fetchone()[0]
+    # All the users share one hash, hashing a million passwords would take hours.
+    password_hash = hash_password(password)
+
+    db.executemany(
+        'INSERT INTO user (id, username, password) VALUES (?, ?, ?)',
+        ((id, f'user{id}', password_hash) for id in range(first_user, first_user + users))
+    )
+    db.commit()
+
+    # Posts are one minute apart, in id order, so the inserts append to the end of the indexes instead of splitting pages.
+    start = calendar.timegm((2015, 1, 1, 0, 0, 0))
+    def post(n):
+        post_body = body()
+        author = first_user + n % users
+        return (f'Post {n}', post_body) + summarize_body(post_body) + (
+            author, f'user{author}', time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start + n * 60))
+        )
+
+    rows = (post(n) for n in range(posts if users else 0))
+
+    # The post_insert_version trigger would update post_version and the author's posts_version once for every row,
+    # which more than doubles the cost of the load.
+    # It is dropped while each batch is inserted and the versions are bumped once per batch instead, every user's at once.
+    trigger = db.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'post_insert_version'"
+    ).fetchone()
+
+    # Large transactions avoid a commit per row, while bounding the size of the write-ahead log.
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        db.execute('BEGIN')
+        if trigger is not None:
+            db.execute('DROP TRIGGER post_insert_version')
+        db.executemany(
+            'INSERT INTO post (title, body, excerpt, body_length, word_count, truncated, author_id, author_username, created)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            batch
+        )
+        if trigger is not None:
+            db.execute(trigger['sql'])
+            db.execute('UPDATE post_version SET version = version + 1, modified = CURRENT_TIMESTAMP')
+            db.execute('UPDATE user SET posts_version = posts_version + 1, posts_modified = CURRENT_TIMESTAMP')
+        db.commit()
+
+
+# Writes every post to `f` as JSON Lines, one object per post in id order, and returns how many there were.
+# Posts are read from the cursor one at a time, so memory use doesn't grow with the number of posts.
+def export_posts(f):
+    count = 0
+    for id, author, title, body, created in get_db().execute(
+        'SELECT id, author_username, title, body, CAST(created AS TEXT) FROM post ORDER BY id'
+    ):
+        post = {'id': id, 'author': author, 'title': title, 'body': body, 'created': created}
+        f.write(json.dumps(post, ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+
+# The post table's indexes and the insert triggers that import_posts() drops while it loads posts and restores afterwards.
+# Building an index once over all the rows is much faster than updating it for every row inserted,
+# and the search index is rebuilt in one go the same way.
+IMPORT_DEFERRED_TRIGGERS = ('post_insert_version', 'post_search_insert', 'post_author_username')
+
+
+# Adds the posts read as JSON Lines from `lines`, in transactions of `batch_size` posts, and returns how many there were.
+# Each post needs an author (a username), a title and a body, all strings, and can have an ISO 8601 created timestamp and an id.
+# With `keep_ids` the posts keep their ids, which restores an export exactly but fails on ids the database already has.
+# Authors missing from the database are added without a password, so they can't log in until they are given one.
+# The indexes are missing while the import runs, so reading posts is slow until it finishes.
+# If a post fails to insert, the batches before it stay imported.
+def import_posts(lines, batch_size=10000, keep_ids=True):
+    from portfolio.blog import summarize_body
+
+    db = get_db()
+    authors = {}
+
+    def author_id(username):
+        if username not in authors:
+            row = db.execute('SELECT id FROM user WHERE username = ?', (username,)).fetchone()
+            if row is not None:
+                authors[username] = row['id']
+            else:
+                authors[username] = db.execute(
+                    "INSERT INTO user (username, password) VALUES (?, '')", (username,)
+                ).lastrowid
+        return authors[username]
+
+    def read_posts():
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield read_post(json.loads(line))
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f'Line {number} is not a valid post: {e!r}')
+
+    def read_post(post):
+        author, title, body = post['author'], post['title'], post['body']
+        created, id = post.get('created'), post.get('id')
+        if not all(isinstance(value, str) for value in (author, title, body)):
+            raise ValueError('author, title and body must be strings')
+        if id is not None and (not isinstance(id, int) or isinstance(id, bool) or not -2 ** 63 <= id < 2 ** 63):
+            raise ValueError(f'{id!r} is not a valid id')
+        if created is not None:
+            # Timestamps are stored the way CURRENT_TIMESTAMP writes them, in UTC, so they sort and page with the other posts.
+            created = datetime.fromisoformat(created)
+            if created.tzinfo is not None:
+                created = created.astimezone(timezone.utc)
+            created = created.strftime('%Y-%m-%d %H:%M:%S')
+        return author, title, body, created, id
+
+    # An import that was killed before it could put back what it dropped is finished off first.
+    restore_deferred(db)
+
+    # The statements that recreate what is dropped are saved in the same transaction as the drops,
+    # so they are never lost, however the import ends.
+    db.execute('BEGIN')
+    deferred = db.execute(
+        "SELECT type, name, sql FROM sqlite_master WHERE tbl_name = 'post' AND sql IS NOT NULL"
+        " AND (type = 'index' OR (type = 'trigger' AND name IN (?, ?, ?)))",
+        IMPORT_DEFERRED_TRIGGERS
+    ).fetchall()
+    for type, name, sql in deferred:
+        db.execute('INSERT INTO import_deferred (name, sql) VALUES (?, ?)', (name, sql))
+        db.execute(f'DROP {type.upper()} {name}')
+    db.commit()
+
+    posts = read_posts()
+    count = 0
+    try:
+        while True:
+            db.execute('BEGIN')
+            # The batch is built before executemany() runs, since adding an author inserts into the user table.
+            batch = [
+                (id if keep_ids else None, title, body) + summarize_body(body) + (author_id(author), author, created)
+                for author, title, body, created, id in itertools.islice(posts, batch_size)
+            ]
+            if not batch:
+                db.rollback()
+                break
+            db.executemany(
+                'INSERT INTO post'
+                ' (id, title, body, excerpt, body_length, word_count, truncated, author_id, author_username, created)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))',
+                batch
+            )
+            db.commit()
+            count += len(batch)
+    finally:
+        if db.in_transaction:
+            db.rollback()
+        restore_deferred(db)
+
+    return count
+
+
+# Recreates the indexes and triggers an import dropped, from the statements it saved in the import_deferred table.
+# The search index is rebuilt if its insert trigger was among them, and post_version and every user's posts_version go up,
+# since posts were added.
+# migrate-db and the next import call this too, in case an import was killed before it could.
+def restore_deferred(db):
+    deferred = db.execute('SELECT name, sql FROM import_deferred').fetchall()
+    if not deferred:
+        return
+
+    db.execute('BEGIN')
+    for _, sql in deferred:
+        db.execute(sql)
+    if any(name == 'post_search_insert' for name, _ in deferred):
+        db.execute("INSERT INTO post_search (post_search) VALUES ('rebuild')")
+    db.execute('UPDATE post_version SET version = version + 1, modified = CURRENT_TIMESTAMP')
+    db.execute('UPDATE user SET posts_version = posts_version + 1, posts_modified = CURRENT_TIMESTAMP')
+    db.execute('DELETE FROM import_deferred')
+    db.commit()
+
+
+@click.command('seed-db')
+@click.option('--users', default=1000, show_default=True)
+@click.option('--posts', default=100000, show_default=True)
+@click.option('--body-length', default=500, show_default=True, help='Average post body length in characters.')
+@click.option('--distribution', type=click.Choice(list(BODY_LENGTHS)), default='exponential', show_default=True,
+              help='How post body lengths are spread around the average.')
+@click.option('--seed', default=0, show_default=True, help='Random seed, the same seed gives the same data.')
+@click.option('--batch-size', default=50000, show_default=True, help='Rows inserted per transaction.')
+@with_appcontext
+def seed_db_command(users, posts, body_length, distribution, seed, batch_size):
+    # Fill the database with synthetic users and posts
+    start = time.perf_counter()
+    seed_db(users, posts, body_length, distribution, seed, batch_size)
+    elapsed = time.perf_counter() - start
+    click.echo(f'Seeded {users} users and {posts} posts in {elapsed:.1f}s.')
+
+
+@click.command('export-posts')
+@click.argument('output', type=click.File('w', encoding='utf8'), default='-')
+@with_appcontext
+def export_posts_command(output):
+    # Write every post to OUTPUT (standard output by default) as JSON Lines
+    start = time.perf_counter()
+    count = export_posts(output)
+    elapsed = time.perf_counter() - start
+    # The report goes to standard error, so it doesn't end up in an export written to standard output.
+    click.echo(f'Exported {count} posts in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} posts/s).', err=True)
+
+
+@click.command('import-posts')
+@click.argument('input', type=click.File('r', encoding='utf8'), default='-')
+@click.option('--batch-size', default=10000, show_default=True, help='Posts inserted per transaction.')
+@click.option('--new-ids', is_flag=True, help='Give the posts new ids instead of the ones in INPUT.')
+@with_appcontext
+def import_posts_command(input, batch_size, new_ids):
+    # Add the posts from INPUT (standard input by default), as written by export-posts
+    from portfolio.cache import get_cache
+
+    start = time.perf_counter()
+    try:
+        count = import_posts(input, batch_size, keep_ids=not new_ids)
+    except (ValueError, sqlite3.IntegrityError) as e:
+        raise click.ClickException(str(e))
+    elapsed = time.perf_counter() - start
+    # Cached pages don't have the new posts. Clearing them here only reaches caches shared with the server, like 'file'.
+    get_cache().clear()
+    click.echo(f'Imported {count} posts in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} posts/s).', err=True)
+
+
+@click.command('migrate-db')
+@with_appcontext
+def migrate_db_command():
+    # Upgrade an existing database in place, keeping its data
+    version = migrate_db()
+    click.echo(f'Migrated the database to version {version}.')
+
+
 def init_app(app):
+    from portfolio.queries import QUERIES
+
+    # Each app gets its own pool for the database it is configured with. Connections are opened the first time they are needed.
+    app.extensions['portfolio_db_pool'] = ConnectionPool(
+        app.config['DATABASE'],
+        pragmas=app.config['SQLITE_PRAGMAS'],
+        max_size=app.config['DATABASE_POOL_SIZE'],
+        timeout=app.config['DATABASE_POOL_TIMEOUT'],
+        check_interval=app.config['DATABASE_POOL_CHECK_INTERVAL'],
+        # Leave room for the ad hoc statements next to every statement in portfolio.queries.
+        cached_statements=max(app.config['DATABASE_STATEMENT_CACHE'], 2 * len(QUERIES)),
+    )
+    app.after_request(report_queries)
     # Tells flask to call the function when cleaning up after returning the response
     app.teardown_appcontext(close_db)
     # Adds a new command that can be called with the `flask` command
     app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_db_command)
+    app.cli.add_command(seed_db_command)
+    app.cli.add_command(export_posts_command)
+    app.cli.add_command(import_posts_command)
@@ -0,0 +1,148 @@
+import threading
+from collections import Counter
+
+from portfolio.db import FastRowFactory
+
+# Every fixed SQL statement the views run, by name.
+# sqlite3 keeps a cache of prepared statements on each connection, keyed by the exact SQL text.
+# Running the views' SQL from here means each statement is always the identical string,
+# so a pooled connection parses and plans it once and then reuses it for the rest of its life.
+QUERIES = {
+    # auth
+    'user_by_id': 'SELECT * FROM user WHERE id = ?',
+    'user_by_username': 'SELECT * FROM user WHERE username = ?',
+    'user_exists': 'SELECT id FROM user WHERE username = ?',
+    'author_by_username': 'SELECT id, username, posts_version, posts_modified FROM user WHERE username = ?',
+    'insert_user': 'INSERT INTO user (username, password) VALUES (?, ?)',
+    'update_user_password': 'UPDATE user SET password = ? WHERE id = ?',
+
+    # blog
+    'post_version': 'SELECT version, modified FROM post_version WHERE id = 1',
+    # Posts carry a copy of their author's username, so reading them doesn't join the user table.
+    'posts_first_page': (
+        'SELECT p.id, title, excerpt, body_length, word_count, truncated, CAST(created AS TEXT) AS created, author_id, author_username AS username'
+        ' FROM post p'
+        ' ORDER BY p.created DESC, p.id DESC'
+        ' LIMIT ?'
+    ),
+    'posts_older_page': (
+        'SELECT p.id, title, excerpt, body_length, word_count, truncated, CAST(created AS TEXT) AS created, author_id, author_username AS username'
+        ' FROM post p'
+        ' WHERE (p.created, p.id) < (?, ?)'
+        ' ORDER BY p.created DESC, p.id DESC'
+        ' LIMIT ?'
+    ),
+    'posts_newer_page': (
+        'SELECT p.id, title, excerpt, body_length, word_count, truncated, CAST(created AS TEXT) AS created, author_id, author_username AS username'
+        ' FROM post p'
+        ' WHERE (p.created, p.id) > (?, ?)'
+        ' ORDER BY p.created ASC, p.id ASC'
+        ' LIMIT ?'
+    ),
+    # The same pages limited to one author's posts, which SQLite reads in order from post_author_created_idx.
+    'author_posts_first_page': (
+        'SELECT p.id, title, excerpt, body_length, word_count, truncated, CAST(created AS TEXT) AS created, author_id, author_username AS username'
+        ' FROM post p'
+        ' WHERE p.author_id = ?'
+        ' ORDER BY p.created DESC, p.id DESC'
+        ' LIMIT ?'
+    ),
+    'author_posts_older_page': (
+        'SELECT p.id, title, excerpt, body_length, word_count, truncated, CAST(created AS TEXT) AS created, author_id, author_username AS username'
+        ' FROM post p'
+        ' WHERE p.author_id = ? AND (p.created, p.id) < (?, ?)'
+        ' ORDER BY p.created DESC, p.id DESC'
+        ' LIMIT ?'
+    ),
+    'author_posts_newer_page': (
+        'SELECT p.id, title, excerpt, body_length, word_count, truncated, CAST(created AS TEXT) AS created, author_id, author_username AS username'
+        ' FROM post p'
+        ' WHERE p.author_id = ? AND (p.created, p.id) > (?, ?)'
+        ' ORDER BY p.created ASC, p.id ASC'
+        ' LIMIT ?'
+    ),
+    # The snippet marks the matches with control characters, which the highlight filter turns into <mark> tags
+    # after the rest of the text is escaped.
+    'search_posts_first_page': (
+        "SELECT p.id, p.title, snippet(post_search, 1, char(2), char(3), '\u2026', 24) AS snippet,"
+        ' CAST(created AS TEXT) AS created, author_id, author_username AS username, rank'
+        ' FROM post_search s JOIN post p ON p.id = s.rowid'
+        ' WHERE post_search MATCH ?'
+        ' ORDER BY rank, s.rowid'
+        ' LIMIT ?'
+    ),
+    'search_posts_next_page': (
+        "SELECT p.id, p.title, snippet(post_search, 1, char(2), char(3), '\u2026', 24) AS snippet,"
+        ' CAST(created AS TEXT) AS created, author_id, author_username AS username, rank'
+        ' FROM post_search s JOIN post p ON p.id = s.rowid'
+        ' WHERE post_search MATCH ? AND (rank, s.rowid) > (?, ?)'
+        ' ORDER BY rank, s.rowid'
+        ' LIMIT ?'
+    ),
+    'post_revision': 'SELECT revision FROM post WHERE id = ?',
+    'post_by_id': (
+        'SELECT p.id, title, body, word_count, created, author_id, author_username AS username, revision'
+        ' FROM post p'
+        ' WHERE p.id = ?'
+    ),
+    # The author's username is copied from the user table as the post is inserted, never from a cached user that may be out of date.
+    'insert_post': (
+        'INSERT INTO post (title, body, excerpt, body_length, word_count, truncated, author_id, author_username)'
+        ' SELECT ?, ?, ?, ?, ?, ?, id, username FROM user WHERE id = ?'
+    ),
+    'update_post': (
+        'UPDATE post SET title = ?, body = ?, excerpt = ?, body_length = ?, word_count = ?, truncated = ? WHERE id = ?'
+    ),
+    'delete_post': 'DELETE FROM post WHERE id = ?',
+}
+
+# Queries whose rows are FastRows instead of sqlite3.Rows. These are the queries that return many rows per request.
+# Their timestamps are selected with CAST(... AS TEXT), so PARSE_DECLTYPES leaves them for FastRow to parse lazily.
+# The CAST is named like the column, so WHERE and ORDER BY must use the qualified column (p.created) to keep using the index.
+FAST_ROW_QUERIES = {
+    'posts_first_page', 'posts_older_page', 'posts_newer_page',
+    'author_posts_first_page', 'author_posts_older_page', 'author_posts_newer_page',
+    'search_posts_first_page', 'search_posts_next_page',
+}
+
+_lock = threading.Lock()
+_hits = Counter()
+_misses = Counter()
+
+
+# Runs the query called `name` on `db` and returns its cursor.
+# A query a connection has run before counts as a statement cache hit, the first run on each connection as a miss.
+# DATABASE_STATEMENT_CACHE is kept larger than QUERIES, so a query a connection has already run is still prepared.
+def execute(db, name, parameters=()):
+    prepared = db.prepared_queries
+    hit = name in prepared
+    if not hit:
+        prepared.add(name)
+
+    with _lock:
+        (_hits if hit else _misses)[name] += 1
+
+    cursor = db.execute(QUERIES[name], parameters)
+    # sqlite3 applies a cursor's row factory when rows are fetched, so it can still be changed after execute().
+    if name in FAST_ROW_QUERIES:
+        cursor.row_factory = FastRowFactory()
+    return cursor
+
+
+# Statement cache hits and misses of this process, in total and by query.
+def stats():
+    with _lock:
+        return {
+            'hits': sum(_hits.values()),
+            'misses': sum(_misses.values()),
+            'queries': {
+                name: {'hits': _hits[name], 'misses': _misses[name]}
+                for name in QUERIES if _hits[name] or _misses[name]
+            },
+        }
+
+
+def reset_stats():
+    with _lock:
+        _hits.clear()
+        _misses.clear()
@@ -1,10 +1,16 @@
 DROP TABLE IF EXISTS user;
 DROP TABLE IF EXISTS post;
+DROP TABLE IF EXISTS post_version;
+DROP TABLE IF EXISTS post_search;
+DROP TABLE IF EXISTS import_deferred;
 
 CREATE TABLE user (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   username TEXT UNIQUE NOT NULL,
-  password TEXT NOT NULL
+  password TEXT NOT NULL,
+  -- Like post_version, for this user's posts alone, so a post only changes the version of its author's pages.
+  posts_version INTEGER NOT NULL DEFAULT 0,
+  posts_modified TIMESTAMP
 );
 
 CREATE TABLE post (
@@ -13,5 +19,90 @@ CREATE TABLE post (
   created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   title TEXT NOT NULL,
   body TEXT NOT NULL,
+  -- Kept up to date by the blog views from body, so the index never has to read whole bodies.
+  excerpt TEXT NOT NULL DEFAULT '',
+  body_length INTEGER NOT NULL DEFAULT 0,
+  word_count INTEGER NOT NULL DEFAULT 0,
+  -- A copy of the author's username, so reading posts doesn't need a join with user. The triggers below keep it current.
+  author_username TEXT,
+  -- Goes up by one every time the post changes, see the post_revision trigger. Cached post pages are keyed by it.
+  revision INTEGER NOT NULL DEFAULT 0,
+  -- Whether excerpt is cut short of the whole body, set with the other summary columns.
+  truncated INTEGER NOT NULL DEFAULT 0,
   FOREIGN KEY (author_id) REFERENCES user (id)
-);
\ No newline at end of file
+);
+
+-- Lets the index page seek to a (created, id) cursor and read posts in order without sorting the whole table.
+CREATE INDEX post_created_idx ON post (created, id);
+-- Finds an author's posts and pages through them in the same (created, id) order as the index page.
+CREATE INDEX post_author_created_idx ON post (author_id, created, id);
+
+-- Fills in author_username for posts inserted without it, e.g. by hand. The blog views set it themselves.
+CREATE TRIGGER post_author_username AFTER INSERT ON post WHEN new.author_username IS NULL BEGIN
+  UPDATE post SET author_username = (SELECT username FROM user WHERE id = new.author_id) WHERE id = new.id;
+END;
+
+CREATE TRIGGER user_username_update AFTER UPDATE OF username ON user BEGIN
+  UPDATE post SET author_username = new.username WHERE author_id = new.id;
+END;
+
+-- Bumps the revision of a post that changed in any other way. The WHEN clause keeps the trigger's own update from counting.
+CREATE TRIGGER post_revision AFTER UPDATE ON post WHEN new.revision = old.revision BEGIN
+  UPDATE post SET revision = old.revision + 1 WHERE id = new.id;
+END;
+
+-- A single row that changes whenever a post is added, edited or deleted.
+-- Pages built from posts use it for their ETag and Last-Modified headers, so a conditional request costs one primary key lookup.
+-- The triggers below also bump the posts_version of the post's author, for the author pages.
+CREATE TABLE post_version (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  version INTEGER NOT NULL,
+  modified TIMESTAMP NOT NULL
+);
+
+INSERT INTO post_version (id, version, modified) VALUES (1, 0, CURRENT_TIMESTAMP);
+
+CREATE TRIGGER post_insert_version AFTER INSERT ON post BEGIN
+  UPDATE post_version SET version = version + 1, modified = CURRENT_TIMESTAMP;
+  UPDATE user SET posts_version = posts_version + 1, posts_modified = CURRENT_TIMESTAMP WHERE id = new.author_id;
+END;
+
+CREATE TRIGGER post_update_version AFTER UPDATE ON post BEGIN
+  UPDATE post_version SET version = version + 1, modified = CURRENT_TIMESTAMP;
+  UPDATE user SET posts_version = posts_version + 1, posts_modified = CURRENT_TIMESTAMP
+    WHERE id IN (old.author_id, new.author_id);
+END;
+
+CREATE TRIGGER post_delete_version AFTER DELETE ON post BEGIN
+  UPDATE post_version SET version = version + 1, modified = CURRENT_TIMESTAMP;
+  UPDATE user SET posts_version = posts_version + 1, posts_modified = CURRENT_TIMESTAMP WHERE id = old.author_id;
+END;
+
+-- Full text index of the posts' titles and bodies for the search page.
+-- It reads the text from the post table instead of keeping a copy, and the triggers below keep it in step with the posts.
+CREATE VIRTUAL TABLE post_search USING fts5(
+  title, body, content='post', content_rowid='id', tokenize='porter unicode61'
+);
+
+-- Results are ranked by BM25, with a match in the title counting ten times as much as one in the body.
+INSERT INTO post_search (post_search, rank) VALUES ('rank', 'bm25(10.0, 1.0)');
+
+CREATE TRIGGER post_search_insert AFTER INSERT ON post BEGIN
+  INSERT INTO post_search (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+
+CREATE TRIGGER post_search_update AFTER UPDATE OF title, body ON post BEGIN
+  INSERT INTO post_search (post_search, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+  INSERT INTO post_search (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+
+CREATE TRIGGER post_search_delete AFTER DELETE ON post BEGIN
+  INSERT INTO post_search (post_search, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+END;
+
+-- The statements that recreate the indexes and triggers import_posts() drops while it runs. They are saved in the same
+-- transaction as the drops, so an import that is killed leaves them here for the next import or migrate-db to run.
+CREATE TABLE import_deferred (
+  name TEXT PRIMARY KEY,
+  sql TEXT NOT NULL
+);
@@ -0,0 +1,32 @@
+import os
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+
+
+def get_template_cache_dir(app):
+    return app.config['TEMPLATE_CACHE_DIR'] or os.path.join(app.instance_path, 'template_cache')
+
+
+@click.command('compile-templates')
+@with_appcontext
+def compile_templates_command():
+    # Compile every template into the bytecode cache, so the first requests a new worker serves don't have to
+    env = current_app.jinja_env
+    names = env.list_templates()
+    for name in names:
+        env.get_template(name)
+    click.echo(f'Compiled {len(names)} templates into {get_template_cache_dir(current_app)}.')
+
+
+def init_app(app):
+    # Jinja compiles each template to Python code the first time a process uses it.
+    # The bytecode cache stores the compiled code on disk, so a fresh worker process loads it instead of compiling again.
+    # Jinja checks each template's modification time, so an edited template is still recompiled.
+    if app.config['TEMPLATE_BYTECODE_CACHE']:
+        directory = get_template_cache_dir(app)
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+    app.cli.add_command(compile_templates_command)
@@ -0,0 +1,145 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import current_app
+
+from portfolio.db import connect
+from portfolio.queries import execute
+
+# With GROUP_COMMIT on, the blog views hand their writes to a single writer thread instead of committing them themselves.
+# The thread waits up to GROUP_COMMIT_MAX_DELAY seconds after the first write for others to arrive, runs them all
+# in one transaction and commits once, so a burst of new posts shares one fsync instead of each paying for its own
+# and queueing up for SQLite's write lock.
+
+
+class GroupCommitWriter(object):
+    def __init__(self, database, pragmas=None, max_batch=100, max_delay=0.005):
+        self.database = database
+        self.pragmas = pragmas or {}
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        # Number of transactions committed, for the tests and benchmarks.
+        self.commits = 0
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._db = None
+        self._pid = None
+
+    # Runs the query called `name` from portfolio.queries in the next batch and waits until that batch is committed.
+    # Returns the id of the inserted row, if any, or raises the error the query or the commit failed with.
+    def submit(self, name, parameters=()):
+        future = Future()
+        self._start().put((name, parameters, future))
+        return future.result()
+
+    def _start(self):
+        with self._lock:
+            # A thread doesn't survive a fork, so a worker forked after the writer was used starts its own.
+            # A thread that died some other way is replaced too, rather than leaving writes queued with nobody to run them.
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, args=(self._queue,), daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+            return self._queue
+
+    def _run(self, operations):
+        # The connection is opened with the first batch, so an error opening it goes to that batch's requests.
+        self._db = None
+        try:
+            stopping = False
+            while not stopping:
+                batch, stopping = self._collect(operations)
+                if batch:
+                    self._commit(batch)
+        finally:
+            if self._db is not None:
+                self._db.close()
+
+    # Waits for an operation, then for more until the batch is full or max_delay has passed.
+    # Returns the batch and whether close() has been called.
+    def _collect(self, operations):
+        first = operations.get()
+        if first is None:
+            return [], True
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                operation = operations.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if operation is None:
+                return batch, True
+            batch.append(operation)
+        return batch, False
+
+    def _commit(self, batch):
+        results = []
+        try:
+            if self._db is None:
+                self._db = connect(self.database, self.pragmas)
+            db = self._db
+            db.execute('BEGIN IMMEDIATE')
+            for name, parameters, future in batch:
+                # Each operation runs in a savepoint, so one that fails is undone alone and the rest of the batch still commits.
+                db.execute('SAVEPOINT operation')
+                try:
+                    cursor = execute(db, name, parameters)
+                except sqlite3.Error as e:
+                    db.execute('ROLLBACK TO operation')
+                    future.set_exception(e)
+                else:
+                    results.append((future, cursor.lastrowid))
+                db.execute('RELEASE operation')
+            db.commit()
+        # Any error, not only the database's, fails the writes that haven't been answered yet.
+        # Otherwise their requests would wait forever for a result.
+        except Exception as e:
+            try:
+                if self._db is not None and self._db.in_transaction:
+                    self._db.rollback()
+            except sqlite3.Error:
+                # The connection is in an unknown state, so the next batch opens a new one.
+                self._db.close()
+                self._db = None
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.commits += 1
+        # Requests only hear about their writes once they are committed.
+        for future, result in results:
+            future.set_result(result)
+
+    # Commits the writes already submitted and stops the thread.
+    def close(self):
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                self._queue.put(None)
+                self._thread.join()
+            self._thread = None
+
+
+def get_writer(app=None):
+    return (app or current_app).extensions['portfolio_writer']
+
+
+def init_app(app):
+    # The thread and its connection are only started by the first write, so the writer costs nothing while GROUP_COMMIT is off.
+    app.extensions['portfolio_writer'] = GroupCommitWriter(
+        app.config['DATABASE'],
+        pragmas=app.config['SQLITE_PRAGMAS'],
+        max_batch=app.config['GROUP_COMMIT_MAX_BATCH'],
+        max_delay=app.config['GROUP_COMMIT_MAX_DELAY'],
+    )
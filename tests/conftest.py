@@ -3,14 +3,16 @@ import tempfile
 
 import pytest
 from portfolio import create_app
-from portfolio.db import get_db, init_db
+from portfolio.auth import get_hasher
+from portfolio.db import get_db, get_pool, init_db
+from portfolio.writer import get_writer
 
 with open(os.path.join(os.path.dirname(__file__), 'data.sql'), 'rb') as f:
     _data_sql = f.read().decode('utf8')
 
 # Pytest uses fixtures by matching their function names with the names of arguments in the test functions.
 @pytest.fixture
-def app():
+def app(tmp_path):
     # Creates and opens a temporary file, returning the file object and the path to it.
     db_fd, db_path = tempfile.mkstemp()
 
@@ -18,9 +20,12 @@ def app():
     # and database for testing instead of using your local development configuration.
     app = create_app({
         # Tells Flask that the app is in test mode.
-        'TESTIING': True,
+        'TESTING': True,
         # The DATABASE path is overridden so it points to this temporary path instead of the instance folder. 
         'DATABASE': db_path,
+        # Compiled templates go in the test's own temporary directory instead of the instance folder.
+        'TEMPLATE_CACHE_DIR': str(tmp_path / 'template_cache'),
+        'ASSETS_DIR': str(tmp_path / 'assets'),
     })
 
     with app.app_context():
@@ -29,6 +34,9 @@ def app():
 
     yield app
 
+    get_pool(app).close()
+    get_hasher(app).shutdown()
+    get_writer(app).close()
     os.close(db_fd)
     os.unlink(db_path)
 
@@ -61,3 +69,30 @@ class AuthActions(object):
 @pytest.fixture
 def auth(client):
     return AuthActions(client)
+
+
+class PostActions(object):
+    def __init__(self, app):
+        self._app = app
+
+    # Adds `count` posts by the test user, one day apart, after the post from data.sql.
+    def add(self, count):
+        with self._app.app_context():
+            db = get_db()
+            db.executemany(
+                "INSERT INTO post (title, body, excerpt, body_length, word_count, author_id, created)"
+                " VALUES (?, 'body', 'body', 4, 1, 1, ?)",
+                [(f'post {n}', f'2019-01-{n:02d} 00:00:00') for n in range(1, count + 1)]
+            )
+            db.commit()
+
+    # The current post_version, which the index pages are cached under.
+    def version(self):
+        with self._app.app_context():
+            return get_db().execute('SELECT version FROM post_version').fetchone()[0]
+
+
+# With the posts fixture, a test can add posts with posts.add() and read the posts version with posts.version().
+@pytest.fixture
+def posts(app):
+    return PostActions(app)
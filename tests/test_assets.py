@@ -0,0 +1,43 @@
+import gzip
+import os
+import re
+
+
+def test_unbuilt_static(client):
+    # Without a build the original file is linked and served.
+    assert b'href="/static/style.css"' in client.get('/').data
+    response = client.get('/static/style.css')
+    assert response.status_code == 200
+    assert 'immutable' not in response.headers.get('Cache-Control', '')
+    response.close()
+
+
+def test_build_assets(runner, app, client):
+    result = runner.invoke(args=['build-assets'])
+    assert 'Built 1 assets' in result.output
+
+    with open(os.path.join(app.static_folder, 'style.css'), 'rb') as f:
+        original = f.read()
+
+    url = re.search(rb'href="(/static/style\.[0-9a-f]{12}\.css)"', client.get('/').data).group(1).decode()
+
+    response = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'text/css'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data) == original
+    response.close()
+
+    # Clients that don't accept gzip get the file as it is.
+    response = client.get(url)
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == original
+    response.close()
+
+    # The original name still works for anything that doesn't use url_for.
+    response = client.get('/static/style.css')
+    assert response.data == original
+    response.close()
+
+    assert client.get('/static/manifest.json').status_code == 404
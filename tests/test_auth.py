@@ -1,5 +1,8 @@
 import pytest
-from portfolio import g, session
+from flask import g, session
+from werkzeug.exceptions import ServiceUnavailable
+from portfolio import auth as auth_module
+from portfolio.auth import get_hasher, user_changed
 from portfolio.db import get_db
 
 def test_register(client, app):
@@ -60,4 +63,81 @@ def test_logout(client, auth):
 
     with client:
         auth.logout()
-        assert 'user_id' not in session
\ No newline at end of file
+        assert 'user_id' not in session
+
+def test_user_cache(client, auth, app):
+    auth.login()
+    client.get('/')
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE user SET username = 'renamed' WHERE id = 1")
+        db.commit()
+
+    # The user is served from the cache until the change is announced.
+    with client:
+        client.get('/')
+        assert g.user['username'] == 'test'
+
+    with app.app_context():
+        user_changed(1)
+
+    with client:
+        client.get('/')
+        assert g.user['username'] == 'renamed'
+
+
+def test_user_not_loaded_for_static(client, auth):
+    auth.login()
+
+    with client:
+        client.get('/static/style.css')
+        assert 'user' not in g
+
+
+# The test user's hash in data.sql uses 50000 iterations, so logging in upgrades it to the configured method.
+def test_login_rehash(client, auth, app):
+    app.config['PASSWORD_HASH_ITERATIONS'] = 1000
+    auth.login()
+
+    with app.app_context():
+        password = get_db().execute('SELECT password FROM user WHERE id = 1').fetchone()[0]
+    assert password.startswith('pbkdf2:sha256:1000$')
+
+    # The new hash still accepts the password.
+    auth.logout()
+    assert auth.login().headers['Location'] == 'http://localhost/'
+
+
+# A hasher too busy for the upgrade doesn't fail a login whose password was already verified.
+def test_login_rehash_busy(client, auth, app, monkeypatch):
+    def busy(password):
+        raise ServiceUnavailable()
+
+    monkeypatch.setattr(auth_module, 'hash_password', busy)
+    app.config['PASSWORD_HASH_ITERATIONS'] = 1000
+    assert auth.login().headers['Location'] == 'http://localhost/'
+
+    with app.app_context():
+        password = get_db().execute('SELECT password FROM user WHERE id = 1').fetchone()[0]
+    assert password.startswith('pbkdf2:sha256:50000$')
+
+
+def test_calibrate_password_hash_command(runner):
+    result = runner.invoke(args=['calibrate-password-hash', '--target-ms', '10'])
+    assert result.output.startswith('PASSWORD_HASH_ITERATIONS = ')
+    assert int(result.output.split()[2]) >= 1000
+
+
+# When every worker and queue slot is taken, logins are turned away with a 503 instead of waiting.
+def test_login_busy(client, app):
+    hasher = get_hasher(app)
+    for _ in range(hasher.workers + hasher.max_queued):
+        hasher._slots.acquire()
+
+    response = client.post('/auth/login', data={'username': 'test', 'password': 'test'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+    hasher._slots.release()
+    assert client.post('/auth/login', data={'username': 'test', 'password': 'test'}).status_code == 302
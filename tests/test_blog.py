@@ -0,0 +1,441 @@
+import re
+import sqlite3
+
+import pytest
+from portfolio import blog
+from portfolio.blog import summarize_body
+from portfolio.cache import get_cache
+from portfolio import create_app
+from portfolio.db import get_db, get_pool
+
+
+def test_index(client, auth):
+    response = client.get('/')
+    assert b'Log In' in response.data
+    assert b'Register' in response.data
+
+    auth.login()
+    response = client.get('/')
+    assert b'Log Out' in response.data
+    assert b'test title' in response.data
+    assert b'by <a href="/author/test">test</a> on 2018-01-01' in response.data
+    assert b'test\nbody' in response.data
+    assert b'href="/1/update"' in response.data
+
+
+def test_index_pages(client, app, posts):
+    app.config['POSTS_PER_PAGE'] = 2
+    posts.add(4)
+
+    # The first page has the two newest posts and only links to older posts.
+    response = client.get('/')
+    assert b'post 4' in response.data and b'post 3' in response.data
+    assert b'post 2' not in response.data
+    assert b'Newer posts' not in response.data
+    assert b'/?older=2019-01-03+00%3A00%3A00~4' in response.data
+
+    response = client.get('/?older=2019-01-03 00:00:00~4')
+    assert b'post 2' in response.data and b'post 1' in response.data
+    assert b'post 3' not in response.data
+    assert b'/?newer=2019-01-02+00%3A00%3A00~3' in response.data
+    assert b'/?older=2019-01-01+00%3A00%3A00~2' in response.data
+
+    # The last page has no older link.
+    response = client.get('/?older=2019-01-01 00:00:00~2')
+    assert b'test title' in response.data
+    assert b'Older posts' not in response.data
+
+    # Paging back towards newer posts returns the same pages in the same order.
+    response = client.get('/?newer=2019-01-02 00:00:00~3')
+    assert response.data.index(b'post 4') < response.data.index(b'post 3')
+    assert b'Newer posts' not in response.data
+    assert b'Older posts' in response.data
+
+
+# Posts created in the same second are told apart by id, so none are skipped or repeated across pages.
+def test_index_pages_same_created(client, app):
+    app.config['POSTS_PER_PAGE'] = 1
+
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            "INSERT INTO post (title, body, author_id, created) VALUES ('twin', '', 1, '2018-01-01 00:00:00')"
+        )
+        db.commit()
+
+    response = client.get('/')
+    assert b'twin' in response.data
+    response = client.get('/?older=2018-01-01 00:00:00~2')
+    assert b'test title' in response.data
+
+
+@pytest.mark.parametrize('cursor', ('nonsense', '2018-01-01~x', '~1'))
+def test_index_invalid_cursor(client, cursor):
+    assert client.get('/', query_string={'older': cursor}).status_code == 400
+
+
+# Logged-out visitors get the cached page, which only costs the BEGIN and the query for the version of the posts.
+def test_index_cached_for_anonymous(client, app):
+    app.config['QUERY_SAMPLE_RATE'] = 1
+    assert client.get('/').headers['Server-Timing'].endswith('desc="3 queries"')
+
+    response = client.get('/')
+    assert b'test title' in response.data
+    assert response.headers['Server-Timing'].endswith('desc="2 queries"')
+
+    # A cursor written another way is the same page.
+    client.get('/?older=2019-01-01 00:00:00~2')
+    assert client.get('/?older=2019-01-01~2').headers['Server-Timing'].endswith('desc="2 queries"')
+
+
+# Every process has its own memory cache, and a write only clears the cache of the process that made it.
+# The others still never serve the old page, since it is cached under the old version of the posts.
+def test_index_cache_other_process(client, app):
+    other = create_app({'TESTING': True, 'DATABASE': app.config['DATABASE'], 'TEMPLATE_BYTECODE_CACHE': False})
+    other_client = other.test_client()
+    try:
+        assert b'test title' in other_client.get('/').data
+
+        with app.app_context():
+            db = get_db()
+            db.execute("UPDATE post SET title = 'changed elsewhere' WHERE id = 1")
+            db.commit()
+
+        assert b'changed elsewhere' in other_client.get('/').data
+    finally:
+        get_pool(other).close()
+
+
+# A post written between reading the version and reading the page isn't on the page,
+# so the page matches its ETag and the key it is cached under.
+def test_index_same_snapshot(client, app, monkeypatch, posts):
+    version = posts.version()
+    get_posts_page = blog.get_posts_page
+
+    def write_then_get_posts_page(*args, **kwargs):
+        with sqlite3.connect(app.config['DATABASE']) as db:
+            db.execute("UPDATE post SET title = 'changed meanwhile' WHERE id = 1")
+        return get_posts_page(*args, **kwargs)
+
+    monkeypatch.setattr(blog, 'get_posts_page', write_then_get_posts_page)
+    response = client.get('/')
+    assert response.headers['ETag'] == f'"index-{version}-0"'
+    assert b'test title' in response.data
+
+    with app.app_context():
+        assert b'test title' in get_cache().get('index', f'{version}|None|None')
+
+    monkeypatch.setattr(blog, 'get_posts_page', get_posts_page)
+    assert b'changed meanwhile' in client.get('/').data
+
+
+# Creating, updating or deleting a post drops the cached index pages.
+@pytest.mark.parametrize(('path', 'data', 'shown', 'gone'), (
+    ('/create', {'title': 'created', 'body': ''}, b'created', None),
+    ('/1/update', {'title': 'updated', 'body': ''}, b'updated', b'test title'),
+    ('/1/delete', {}, None, b'test title'),
+))
+def test_index_cache_invalidated(client, auth, path, data, shown, gone):
+    assert b'test title' in client.get('/').data
+
+    auth.login()
+    client.post(path, data=data)
+    auth.logout()
+
+    response = client.get('/')
+    if shown is not None:
+        assert shown in response.data
+    if gone is not None:
+        assert gone not in response.data
+
+
+def test_index_conditional(client, auth):
+    response = client.get('/')
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+    assert 'no-cache' in response.headers['Cache-Control']
+
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+    response = client.get('/', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+
+    # A logged in user sees a different page, so the anonymous ETag doesn't match it.
+    auth.login()
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    user_etag = response.headers['ETag']
+    assert user_etag != etag
+
+    # Any change to the posts changes the ETag.
+    client.post('/1/update', data={'title': 'updated', 'body': ''})
+    response = client.get('/', headers={'If-None-Match': user_etag})
+    assert response.status_code == 200
+    assert b'updated' in response.data
+
+
+def test_index_streaming(client, app, posts):
+    app.config['POSTS_PER_PAGE'] = 2
+    posts.add(3)
+    rendered = client.get('/').data
+
+    with app.app_context():
+        get_cache().clear()
+
+    app.config['INDEX_STREAMING'] = True
+    app.config['STREAM_BUFFER_SIZE'] = 1
+    response = client.get('/', buffered=False)
+    assert response.is_streamed
+    chunks = list(response.response)
+    response.close()
+
+    # The page is sent in many pieces, starting with the header and navigation, and adds up to the same page.
+    assert len(chunks) > 10
+    assert chunks[0].startswith(b'<!doctype html>')
+    assert b''.join(chunks) == rendered
+    assert b'Older posts' in rendered
+
+    # Once the whole page has been sent it is in the page cache.
+    with app.app_context():
+        assert get_cache().get('index', f'{posts.version()}|None|None') == rendered
+
+
+@pytest.mark.parametrize(('body', 'excerpt'), (
+    ('short', 'short'),
+    # Cut at the last whole word.
+    ('one two three four', 'one two…'),
+    # The cut falls right after a word, which is kept.
+    ('one twox three', 'one twox…'),
+    ('onetwothreefour', 'onetwoth…'),
+))
+def test_summarize_body(app, body, excerpt):
+    app.config['POST_EXCERPT_LENGTH'] = 8
+    with app.app_context():
+        assert summarize_body(body) == (excerpt, len(body), len(body.split()), int(excerpt != body))
+
+
+# The index only shows the excerpt of a long post, its whole body is on the post's own page.
+def test_excerpt(client, auth, app):
+    app.config['POST_EXCERPT_LENGTH'] = 20
+    body = 'word ' * 30
+
+    auth.login()
+    client.post('/create', data={'title': 'long', 'body': body})
+    with app.app_context():
+        post = get_db().execute('SELECT * FROM post WHERE id = 2').fetchone()
+        assert (post['body_length'], post['word_count']) == (150, 30)
+
+    response = client.get('/')
+    assert body.encode() not in response.data
+    assert b'Read all 30 words' in response.data
+    assert b'href="/2"' in response.data
+    # Short posts are shown whole, without the link.
+    assert response.data.count(b'Read all') == 1
+
+    client.post('/2/update', data={'title': 'long', 'body': 'now short'})
+    assert b'Read all' not in client.get('/').data
+
+    # One word just too long to show whole is cut to an excerpt as long as the body, and still gets the link.
+    client.post('/2/update', data={'title': 'long', 'body': 'x' * 21})
+    response = client.get('/')
+    assert 'x' * 20 + '\u2026' in response.data.decode()
+    assert b'Read all 1 words' in response.data
+
+
+# A new post gets its author's current username, even when the logged in user was loaded before a rename.
+def test_create_author_username(client, auth, app):
+    auth.login()
+    client.get('/')
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE user SET username = 'renamed' WHERE id = 1")
+        db.commit()
+
+    client.post('/create', data={'title': 'created', 'body': ''})
+
+    with app.app_context():
+        names = get_db().execute('SELECT id, author_username FROM post ORDER BY id').fetchall()
+    assert [tuple(row) for row in names] == [(1, 'renamed'), (2, 'renamed')]
+
+
+def test_detail(client, auth):
+    response = client.get('/1')
+    assert b'test title' in response.data
+    assert b'test\nbody' in response.data
+    assert b'href="/1/update"' not in response.data
+
+    auth.login()
+    assert b'href="/1/update"' in client.get('/1').data
+
+    assert client.get('/2').status_code == 404
+
+
+# Logged-out visitors get the cached post page until the post is edited or deleted.
+def test_detail_cached(client, auth, app):
+    app.config['QUERY_SAMPLE_RATE'] = 1
+    assert b'test title' in client.get('/1').data
+
+    response = client.get('/1')
+    assert b'test title' in response.data
+    # A cached page only costs the BEGIN and the lookup of the post's revision.
+    assert response.headers['Server-Timing'].endswith('desc="2 queries"')
+
+    # The revision changes with any edit, even one made without going through the views, e.g. by another process.
+    with app.app_context():
+        db = get_db()
+        revision = db.execute('SELECT revision FROM post WHERE id = 1').fetchone()[0]
+        db.execute("UPDATE post SET title = 'changed behind the back' WHERE id = 1")
+        db.commit()
+        assert db.execute('SELECT revision FROM post WHERE id = 1').fetchone()[0] == revision + 1
+    assert b'changed behind the back' in client.get('/1').data
+
+    auth.login()
+    client.post('/1/update', data={'title': 'updated', 'body': ''})
+    auth.logout()
+    assert b'updated' in client.get('/1').data
+
+    auth.login()
+    client.post('/1/delete')
+    auth.logout()
+    assert client.get('/1').status_code == 404
+
+
+def post_revision(app, id):
+    with app.app_context():
+        return get_db().execute('SELECT revision FROM post WHERE id = ?', (id,)).fetchone()[0]
+
+
+# Editing or deleting a post drops its cached page and the page's compressed variants, instead of leaving them to be evicted.
+@pytest.mark.parametrize('path', ('/1/update', '/1/delete'))
+def test_detail_cache_dropped(client, auth, app, path):
+    app.config['COMPRESS_MIN_SIZE'] = 0
+    client.get('/1', headers={'Accept-Encoding': 'gzip'})
+    key = f'1|{post_revision(app, 1)}'
+    with app.app_context():
+        assert get_cache().get('post', key) is not None
+        assert get_cache().get('post', f'{key}|gzip') is not None
+
+    auth.login()
+    client.post(path, data={'title': 'updated', 'body': ''})
+
+    with app.app_context():
+        assert get_cache().get('post', key) is None
+        assert get_cache().get('post', f'{key}|gzip') is None
+
+
+def test_detail_conditional(client):
+    etag = client.get('/1').headers['ETag']
+    response = client.get('/1', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_search(client, auth):
+    auth.login()
+    client.post('/create', data={'title': 'apples', 'body': 'a post about <b>fruit</b>'})
+    client.post('/create', data={'title': 'pears', 'body': 'pears are not apples'})
+    client.post('/create', data={'title': 'cars', 'body': 'nothing to see'})
+
+    response = client.get('/search', query_string={'q': 'apple'})
+    # Words are stemmed, and a match in the title ranks higher than one in the body.
+    assert response.data.index(b'href="/2">apples') < response.data.index(b'href="/3">pears')
+    assert b'not <mark>apples</mark>' in response.data
+    # The post's own text is escaped.
+    assert b'&lt;b&gt;fruit&lt;/b&gt;' in response.data
+    assert b'cars' not in response.data
+
+    # Every word has to match.
+    response = client.get('/search', query_string={'q': 'pears apples'})
+    assert b'href="/3"' in response.data and b'href="/2"' not in response.data
+
+    # The index follows edits and deletes.
+    client.post('/3/update', data={'title': 'pears', 'body': 'only pears'})
+    client.post('/2/delete')
+    assert b'No posts match' in client.get('/search', query_string={'q': 'apples'}).data
+
+
+def test_search_pages(client, app, posts):
+    app.config['POSTS_PER_PAGE'] = 2
+    posts.add(5)
+
+    seen = []
+    response = client.get('/search', query_string={'q': 'post'})
+    while True:
+        seen += [int(id) for id in re.findall(rb'href="/(\d+)">post', response.data)]
+        next_page = re.search(rb'href="(/search\?[^"]*after=[^"]*)"', response.data)
+        if next_page is None:
+            break
+        response = client.get(next_page.group(1).decode().replace('&amp;', '&'))
+
+    assert sorted(seen) == [2, 3, 4, 5, 6]
+
+
+@pytest.mark.parametrize('q', ('"', 'title"', 'NOT', '*', 'a AND', '-', '\x00', 'test\x00title'))
+def test_search_syntax(client, q):
+    assert client.get('/search', query_string={'q': q}).status_code == 200
+
+
+@pytest.mark.parametrize('cursor', ('x~1', f'1.0~{2 ** 64}'))
+def test_search_invalid_cursor(client, cursor):
+    assert client.get('/search', query_string={'q': 'test', 'after': cursor}).status_code == 400
+
+
+def test_author(client, app, posts):
+    app.config['POSTS_PER_PAGE'] = 2
+    posts.add(3)
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO post (title, body, author_id, created) VALUES ('by other', '', 2, '2019-02-01 00:00:00')")
+        db.commit()
+
+    response = client.get('/author/test')
+    assert b'Posts by test' in response.data
+    assert b'post 3' in response.data and b'post 2' in response.data
+    assert b'by other' not in response.data
+    # The page links stay on the author's pages.
+    assert b'href="/author/test?older=2019-01-02+00%3A00%3A00~3"' in response.data
+
+    response = client.get('/author/test?older=2019-01-02 00:00:00~3')
+    assert b'post 1' in response.data and b'test title' in response.data
+    assert b'href="/author/test?newer=2019-01-01+00%3A00%3A00~2"' in response.data
+
+    assert b'by other' in client.get('/author/other').data
+    assert client.get('/author/nobody').status_code == 404
+
+
+def author_versions(app):
+    with app.app_context():
+        return dict(get_db().execute('SELECT username, posts_version FROM user').fetchall())
+
+
+# A new post changes its author's pages, and other authors' cached pages are still served.
+def test_author_cache_invalidated(client, auth, app):
+    app.config['QUERY_SAMPLE_RATE'] = 1
+    assert b'test title' in client.get('/author/test').data
+    assert client.get('/author/other').status_code == 200
+    before = author_versions(app)
+
+    auth.login()
+    client.post('/create', data={'title': 'created', 'body': ''})
+    auth.logout()
+
+    after = author_versions(app)
+    assert after['test'] > before['test']
+    assert after['other'] == before['other']
+    assert b'created' in client.get('/author/test').data
+
+    # The other author's page comes from the cache: the BEGIN and the author lookup are the only queries, no posts are read.
+    response = client.get('/author/other')
+    assert response.headers['Server-Timing'].endswith('desc="2 queries"')
+
+    # The test author's old page was dropped by posts_changed() rather than left to wait for eviction.
+    with app.app_context():
+        assert get_cache().get('author-1', f"{before['test']}|None|None") is None
+        assert get_cache().get('author-1', f"{after['test']}|None|None") is not None
+
+
+def test_index_cursor_id_out_of_range(client):
+    assert client.get('/', query_string={'older': f'2018-01-01 00:00:00~{2 ** 64}'}).status_code == 400
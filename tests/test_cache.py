@@ -0,0 +1,102 @@
+import time
+
+import pytest
+from portfolio.cache import FileCache, MemoryCache, TTLCache
+
+
+@pytest.fixture(params=('memory', 'file'))
+def make_cache(request, tmp_path):
+    def make(max_bytes):
+        if request.param == 'memory':
+            return MemoryCache(max_bytes)
+        return FileCache(str(tmp_path), max_bytes)
+
+    return make
+
+
+def test_get_set_delete(make_cache):
+    cache = make_cache(100)
+    assert cache.get('index', 'a') is None
+
+    cache.set('index', 'a', b'page a')
+    assert cache.get('index', 'a') == b'page a'
+    # The same key in another namespace is a different page.
+    assert cache.get('post', 'a') is None
+
+    cache.delete('index', 'a')
+    assert cache.get('index', 'a') is None
+
+
+def test_clear_namespace(make_cache):
+    cache = make_cache(100)
+    cache.set('index', 'a', b'page a')
+    cache.set('post', 'a', b'post a')
+
+    cache.clear('index')
+    assert cache.get('index', 'a') is None
+    assert cache.get('post', 'a') == b'post a'
+
+    cache.clear()
+    assert cache.get('post', 'a') is None
+
+
+def test_lru_eviction(make_cache):
+    cache = make_cache(10)
+    cache.set('index', 'a', b'aaaa')
+    # The file cache orders pages by modification time, so give each step its own timestamp.
+    time.sleep(0.01)
+    cache.set('index', 'b', b'bbbb')
+    time.sleep(0.01)
+    cache.get('index', 'a')
+    time.sleep(0.01)
+    cache.set('index', 'c', b'cccc')
+
+    # b was used least recently, so it made room for c.
+    assert cache.get('index', 'b') is None
+    assert cache.get('index', 'a') == b'aaaa'
+    assert cache.get('index', 'c') == b'cccc'
+
+    # A page bigger than the whole cache isn't stored.
+    cache.set('index', 'd', b'd' * 11)
+    assert cache.get('index', 'd') is None
+
+
+def test_ttl_cache(monkeypatch):
+    now = [0]
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+    cache = TTLCache(2, 10)
+
+    cache.set(1, 'one')
+    cache.set(2, 'two')
+    assert cache.get(1) == 'one'
+    # 2 was used least recently, so it is dropped to keep the size at 2.
+    cache.set(3, 'three')
+    assert cache.get(2) is None
+
+    now[0] = 10
+    assert cache.get(1) is None
+
+
+# The file cache only scans its directory to evict pages when it is over its size, not on every write.
+def test_file_cache_scans_when_full(tmp_path, monkeypatch):
+    cache = FileCache(str(tmp_path), 100)
+    scans = []
+    evict = cache._evict
+    monkeypatch.setattr(cache, '_evict', lambda: scans.append(1) or evict())
+
+    # The first write counts what is already there.
+    for key in 'abcde':
+        cache.set('index', key, b'0123456789')
+    assert len(scans) == 1
+
+    # Rewriting and removing pages keeps the count right.
+    cache.set('index', 'a', b'0123456789' * 2)
+    cache.delete('index', 'b')
+    cache.clear('index')
+    for key in 'fghij':
+        cache.set('index', key, b'0123456789')
+    assert len(scans) == 1
+
+    cache.set('index', 'k', b'0' * 60)
+    assert len(scans) == 2
+    assert cache.get('index', 'k') is not None
@@ -0,0 +1,110 @@
+import gzip
+import zlib
+
+import pytest
+from portfolio import compress
+from portfolio.cache import get_cache
+from portfolio.compress import make_compressor
+
+
+@pytest.mark.parametrize(('encoding', 'decompress'), (
+    ('gzip', gzip.decompress),
+    ('deflate', zlib.decompress),
+))
+def test_compressed(client, app, encoding, decompress, posts):
+    posts.add(20)
+    page = client.get('/').data
+
+    response = client.get('/', headers={'Accept-Encoding': encoding})
+    assert response.headers['Content-Encoding'] == encoding
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert len(response.data) < len(page)
+    assert decompress(response.data) == page
+
+
+def test_not_compressed(client, app, posts):
+    posts.add(20)
+
+    # The client doesn't accept any of the encodings.
+    response = client.get('/', headers={'Accept-Encoding': 'br'})
+    assert 'Content-Encoding' not in response.headers
+
+    # The response is too small to be worth it.
+    response = client.get('/hello', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+    app.config['COMPRESS_RESPONSES'] = False
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+
+# The compressed page has a weak ETag, and sending it back still gets a 304.
+def test_compressed_etag(client, app, posts):
+    posts.add(20)
+
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+
+    response = client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_compressed_streaming(client, app, posts):
+    posts.add(20)
+    page = client.get('/').data
+
+    with app.app_context():
+        get_cache().clear()
+
+    app.config['INDEX_STREAMING'] = True
+    app.config['STREAM_BUFFER_SIZE'] = 1
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    chunks = list(response.response)
+    response.close()
+
+    # Every piece is flushed as it is rendered, and together they decompress to the whole page.
+    assert len(chunks) > 10
+    assert gzip.decompress(b''.join(chunks)) == page
+
+    # The page cache holds the page uncompressed.
+    with app.app_context():
+        assert get_cache().get('index', f'{posts.version()}|None|None') == page
+
+
+# A page served from the page cache is compressed once per encoding, and the compressed bytes are cached next to it.
+@pytest.mark.parametrize('path', ('/', '/1'))
+def test_compressed_cached(client, app, monkeypatch, path, posts):
+    posts.add(20)
+    app.config['COMPRESS_MIN_SIZE'] = 0
+    compressors = []
+
+    def count_compressors(encoding):
+        compressors.append(encoding)
+        return make_compressor(encoding)
+
+    monkeypatch.setattr(compress, 'make_compressor', count_compressors)
+    page = client.get(path).data
+    first = client.get(path, headers={'Accept-Encoding': 'gzip'})
+    second = client.get(path, headers={'Accept-Encoding': 'gzip'})
+    assert compressors == ['gzip']
+    assert second.headers['Content-Encoding'] == 'gzip'
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert gzip.decompress(second.data) == page
+
+    client.get(path, headers={'Accept-Encoding': 'deflate'})
+    assert compressors == ['gzip', 'deflate']
+
+
+# Editing a post drops its compressed variants along with the page.
+def test_compressed_cached_invalidated(client, auth, app):
+    app.config['COMPRESS_MIN_SIZE'] = 0
+    client.get('/1', headers={'Accept-Encoding': 'gzip'})
+
+    auth.login()
+    client.post('/1/update', data={'title': 'updated', 'body': ''})
+    auth.logout()
+
+    response = client.get('/1', headers={'Accept-Encoding': 'gzip'})
+    assert b'updated' in gzip.decompress(response.data)
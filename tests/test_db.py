@@ -1,7 +1,11 @@
+import json
+import logging
 import sqlite3
+from datetime import datetime
 
 import pytest
-from portfolio.db import get_db
+from portfolio import create_app
+from portfolio.db import MIGRATIONS, ConnectionPool, FastRowFactory, get_db, get_pool, import_posts, migrate_db, seed_db
 
 # Within an application context, get_db should return the same connection each time it’s called. After the context, the connection should be closed.
 def test_get_close_db(app):
@@ -27,4 +31,348 @@ def test_init_db_command(runner, monkeypatch):
     monkeypatch.setattr('portfolio.db.init_db', fake_init_db)
     result = runner.invoke(args=['init-db'])
     assert 'Initialized' in result.output
-    assert Recorder.called
\ No newline at end of file
+    assert Recorder.called
+
+# Connections go back to the pool at the end of the app context and are reused by the next one.
+def test_pool_reuses_connection(app):
+    with app.app_context():
+        first = get_db()._connection
+
+    with app.app_context():
+        assert get_db()._connection is first
+
+
+def test_pool_rolls_back_uncommitted(app):
+    with app.app_context():
+        get_db().execute('DELETE FROM post')
+
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM post').fetchone()[0] == 1
+
+
+def test_pool_size_limit(app):
+    pool = ConnectionPool(app.config['DATABASE'], max_size=1, timeout=0.01)
+    db = pool.checkout()
+
+    with pytest.raises(sqlite3.OperationalError) as e:
+        pool.checkout()
+
+    assert 'No database connection' in str(e.value)
+    db.close()
+    pool.checkout().close()
+    pool.close()
+
+
+# An idle connection that fails its health check is replaced with a new one.
+def test_pool_health_check(app):
+    pool = ConnectionPool(app.config['DATABASE'], check_interval=0)
+    db = pool.checkout()
+    broken = db._connection
+    db.close()
+    broken.close()
+
+    db = pool.checkout()
+    assert db._connection is not broken
+    assert db.execute('SELECT 1').fetchone()[0] == 1
+    db.close()
+    pool.close()
+
+
+def test_pragmas(app):
+    with app.app_context():
+        db = get_db()
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert db.execute('PRAGMA synchronous').fetchone()[0] == 1
+        assert db.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+
+    # init_db stores WAL mode in the file, so a plain connection uses it too.
+    db = sqlite3.connect(app.config['DATABASE'])
+    assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    db.close()
+
+
+# A writer holding the database lock doesn't stop readers, who keep seeing the last committed data.
+def test_readers_not_blocked_by_writer(app, client):
+    writer = sqlite3.connect(app.config['DATABASE'], isolation_level=None, timeout=0)
+    writer.execute('BEGIN EXCLUSIVE')
+    writer.execute("INSERT INTO post (title, body, author_id) VALUES ('uncommitted', '', 1)")
+
+    try:
+        with app.app_context():
+            get_db().execute('PRAGMA busy_timeout = 0')
+
+        response = client.get('/')
+        assert response.status_code == 200
+        assert b'test title' in response.data
+        assert b'uncommitted' not in response.data
+    finally:
+        writer.rollback()
+        writer.close()
+
+
+def test_init_db_version(app):
+    with app.app_context():
+        assert get_db().execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS)
+        assert migrate_db() == len(MIGRATIONS)
+
+
+# The schema databases were created with before migrations existed.
+_original_schema = '''
+CREATE TABLE user (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  username TEXT UNIQUE NOT NULL,
+  password TEXT NOT NULL
+);
+
+CREATE TABLE post (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  author_id INTEGER NOT NULL,
+  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  title TEXT NOT NULL,
+  body TEXT NOT NULL,
+  FOREIGN KEY (author_id) REFERENCES user (id)
+);
+
+INSERT INTO user (username, password) VALUES ('test', '');
+INSERT INTO post (title, body, author_id) VALUES ('test title', 'test body', 1);
+'''
+
+
+# A database created with the original schema is upgraded in place, keeping its posts,
+# and ends up with the same tables, indexes and triggers as a new one.
+def test_migrate_db(app, tmp_path):
+    path = str(tmp_path / 'original.sqlite')
+    db = sqlite3.connect(path)
+    db.executescript(_original_schema)
+    db.close()
+
+    old_app = create_app({'TESTING': True, 'DATABASE': path})
+    with old_app.app_context():
+        assert migrate_db() == len(MIGRATIONS)
+        db = get_db()
+        assert db.execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS)
+        assert db.execute('SELECT COUNT(*) FROM post').fetchone()[0] == 1
+        # The summary columns are filled in for the existing post.
+        assert tuple(db.execute('SELECT excerpt, body_length, word_count, truncated FROM post').fetchone()) == (
+            'test body', 9, 2, 0
+        )
+        # The existing post is in the search index.
+        assert [row[0] for row in db.execute("SELECT rowid FROM post_search WHERE post_search MATCH 'body'")] == [1]
+        migrated = {tuple(row) for row in db.execute('SELECT type, name FROM sqlite_master')}
+        columns = [row['name'] for row in db.execute('PRAGMA table_info(post)')]
+    get_pool(old_app).close()
+
+    with app.app_context():
+        db = get_db()
+        assert migrated == {tuple(row) for row in db.execute('SELECT type, name FROM sqlite_master')}
+        assert columns == [row['name'] for row in db.execute('PRAGMA table_info(post)')]
+
+
+def test_migrate_db_command(runner, monkeypatch):
+    monkeypatch.setattr('portfolio.db.migrate_db', lambda: 7)
+    result = runner.invoke(args=['migrate-db'])
+    assert 'Migrated the database to version 7.' in result.output
+
+
+def test_seed_db(app):
+    with app.app_context():
+        db = get_db()
+        version = db.execute('SELECT version FROM post_version').fetchone()[0]
+        seed_db(3, 10, body_length=20, distribution='uniform', seed=1)
+        assert db.execute('SELECT COUNT(*) FROM user').fetchone()[0] == 5
+        # The seeded users come after the two from data.sql and share the posts between them.
+        authors = db.execute('SELECT DISTINCT author_id FROM post WHERE id > 1 ORDER BY author_id').fetchall()
+        assert [row[0] for row in authors] == [3, 4, 5]
+        # post_version goes up once for the whole batch.
+        assert db.execute('SELECT version FROM post_version').fetchone()[0] == version + 1
+        assert db.execute("SELECT author_username FROM post WHERE id = 2").fetchone()[0] == 'user3'
+        bodies = [row[0] for row in db.execute('SELECT body FROM post WHERE id > 1 ORDER BY id')]
+        assert all(len(body) <= 40 for body in bodies)
+
+        # The same seed gives the same posts.
+        seed_db(3, 10, body_length=20, distribution='uniform', seed=1)
+        assert [row[0] for row in db.execute('SELECT body FROM post WHERE id > 11 ORDER BY id')] == bodies
+
+
+def test_seed_db_command(runner, monkeypatch):
+    calls = []
+    monkeypatch.setattr('portfolio.db.seed_db', lambda *args: calls.append(args))
+    result = runner.invoke(args=['seed-db', '--users', '2', '--posts', '5', '--distribution', 'fixed'])
+    assert 'Seeded 2 users and 5 posts' in result.output
+    assert calls == [(2, 5, 500, 'fixed', 0, 50000)]
+
+
+def test_query_timing(client, app, caplog):
+    app.config['QUERY_SAMPLE_RATE'] = 1
+    app.config['SLOW_QUERY_MS'] = 0
+
+    with caplog.at_level(logging.WARNING, logger='portfolio.db.slow_queries'):
+        response = client.get('/')
+
+    # The index begins a read transaction, reads post_version and then the page of posts.
+    assert response.headers['Server-Timing'].startswith('db;dur=')
+    assert response.headers['Server-Timing'].endswith('desc="3 queries"')
+    records = [json.loads(record.getMessage()) for record in caplog.records]
+    assert [record['path'] for record in records] == ['/', '/', '/']
+    assert records[0]['sql'] == 'BEGIN'
+    assert records[2]['sql'].startswith('SELECT p.id, title, excerpt')
+
+
+def test_query_timing_not_sampled(client, app, caplog):
+    app.config['QUERY_SAMPLE_RATE'] = 0
+    app.config['SLOW_QUERY_MS'] = 0
+
+    with caplog.at_level(logging.WARNING, logger='portfolio.db.slow_queries'):
+        response = client.get('/')
+
+    assert 'Server-Timing' not in response.headers
+    assert not caplog.records
+
+
+# Rows fetched through an instrumented connection add to the time of their statement.
+def test_instrumented_cursor(app):
+    pool = ConnectionPool(app.config['DATABASE'])
+    queries = []
+    db = pool.checkout(queries)
+    assert [row['title'] for row in db.execute('SELECT title FROM post')] == ['test title']
+    assert db.execute('SELECT COUNT(*) FROM user').fetchone()[0] == 2
+    assert [query[0] for query in queries] == ['SELECT title FROM post', 'SELECT COUNT(*) FROM user']
+    assert all(query[1] > 0 for query in queries)
+    db.close()
+    pool.close()
+
+
+def test_fast_row(app):
+    with app.app_context():
+        cursor = get_db().execute("SELECT 1 AS id, 'title' AS title, '2018-01-01 00:00:00' AS created")
+        cursor.row_factory = FastRowFactory()
+        row = cursor.fetchone()
+
+    assert row['title'] == row.title == row[1] == 'title'
+    assert row.keys() == ['id', 'title', 'created']
+    # The timestamp stays text until it is read.
+    assert tuple(row)[2] == '2018-01-01 00:00:00'
+    assert row['created'] == datetime(2018, 1, 1)
+
+
+# Posts keep a copy of their author's username, filled in when a post is inserted without one
+# and updated when the username changes.
+def test_author_username(app):
+    with app.app_context():
+        db = get_db()
+        assert db.execute('SELECT author_username FROM post WHERE id = 1').fetchone()[0] == 'test'
+
+        db.execute("UPDATE user SET username = 'renamed' WHERE id = 1")
+        db.commit()
+        assert db.execute('SELECT author_username FROM post WHERE id = 1').fetchone()[0] == 'renamed'
+
+
+def test_export_import_posts(runner, app, tmp_path):
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            'INSERT INTO post (title, body, excerpt, body_length, word_count, author_id, created)'
+            " VALUES ('zweiter Beitrag', 'über', 'über', 4, 1, 2, '2019-01-01 00:00:00')"
+        )
+        db.commit()
+
+    path = str(tmp_path / 'posts.jsonl')
+    result = runner.invoke(args=['export-posts', path])
+    assert 'Exported 2 posts' in result.output
+    with open(path, encoding='utf8') as f:
+        lines = f.read().splitlines()
+    assert json.loads(lines[1]) == {
+        'id': 2, 'author': 'other', 'title': 'zweiter Beitrag', 'body': 'über', 'created': '2019-01-01 00:00:00',
+    }
+
+    query = 'SELECT id, title, body, excerpt, word_count, author_id, author_username, created FROM post ORDER BY id'
+    with app.app_context():
+        db = get_db()
+        exported = [tuple(row) for row in db.execute(query)]
+        schema = {tuple(row) for row in db.execute('SELECT type, name, sql FROM sqlite_master')}
+        db.execute('DELETE FROM post')
+        db.commit()
+
+    result = runner.invoke(args=['import-posts', path, '--batch-size', '1'])
+    assert 'Imported 2 posts' in result.output
+
+    with app.app_context():
+        db = get_db()
+        assert [tuple(row) for row in db.execute(query)] == exported
+        # The indexes and triggers are back, and the search index has the imported posts.
+        assert {tuple(row) for row in db.execute('SELECT type, name, sql FROM sqlite_master')} == schema
+        assert [row[0] for row in db.execute("SELECT rowid FROM post_search WHERE post_search MATCH 'zweiter'")] == [2]
+
+    # The posts are already there with the same ids.
+    result = runner.invoke(args=['import-posts', path])
+    assert result.exit_code != 0
+    assert 'UNIQUE constraint failed' in result.output
+
+    result = runner.invoke(args=['import-posts', path, '--new-ids'])
+    assert 'Imported 2 posts' in result.output
+    with app.app_context():
+        assert [row[0] for row in get_db().execute('SELECT id FROM post ORDER BY id')] == [1, 2, 3, 4]
+
+
+def test_import_posts(runner, app):
+    data = '{"author": "newcomer", "title": "hello", "body": "first post"}\n\n'
+    result = runner.invoke(args=['import-posts'], input=data)
+    assert 'Imported 1 posts' in result.output
+
+    with app.app_context():
+        db = get_db()
+        post = db.execute('SELECT * FROM post WHERE id = 2').fetchone()
+        assert (post['title'], post['author_username'], post['word_count']) == ('hello', 'newcomer', 2)
+        author = db.execute('SELECT * FROM user WHERE id = ?', (post['author_id'],)).fetchone()
+        assert (author['username'], author['password']) == ('newcomer', '')
+
+    result = runner.invoke(args=['import-posts'], input='{"title": "no author"}\n')
+    assert result.exit_code != 0
+    assert 'Line 1 is not a valid post' in result.output
+
+
+# Posts that don't fit the post table are turned away with the line they are on,
+# and timestamps in other ISO 8601 forms are stored the way the posts already there are.
+@pytest.mark.parametrize(('post', 'created'), (
+    ({'created': '2020-01-01T10:00:00'}, '2020-01-01 10:00:00'),
+    ({'created': '2020-01-01 10:00:00.123456'}, '2020-01-01 10:00:00'),
+    ({'created': '2020-01-01T12:00:00+02:00'}, '2020-01-01 10:00:00'),
+    ({'created': '2020-01-01'}, '2020-01-01 00:00:00'),
+    ({'created': 'yesterday'}, None),
+    ({'created': 20200101}, None),
+    ({'body': 5}, None),
+    ({'title': None}, None),
+    ({'author': ['test']}, None),
+    ({'id': 'x'}, None),
+    ({'id': 2 ** 63}, None),
+))
+def test_import_posts_validated(app, post, created):
+    line = json.dumps(dict({'author': 'test', 'title': 'title', 'body': 'body'}, **post))
+
+    with app.app_context():
+        if created is None:
+            with pytest.raises(ValueError, match='Line 2 is not a valid post'):
+                import_posts(['', line])
+        else:
+            assert import_posts(['', line]) == 1
+            assert get_db().execute('SELECT CAST(created AS TEXT) FROM post WHERE id = 2').fetchone()[0] == created
+
+
+# An import killed before it put back the indexes and triggers it dropped leaves them saved,
+# and migrate-db or the next import recreates them.
+@pytest.mark.parametrize('recover', (migrate_db, lambda: import_posts([])))
+def test_import_posts_killed(app, monkeypatch, recover):
+    with app.app_context():
+        db = get_db()
+        schema = {tuple(row) for row in db.execute('SELECT type, name, sql FROM sqlite_master')}
+
+        monkeypatch.setattr('portfolio.db.restore_deferred', lambda db: None)
+        import_posts(['{"author": "test", "title": "zweiter Beitrag", "body": ""}'])
+        monkeypatch.undo()
+        assert 'post_created_idx' in {row[0] for row in db.execute('SELECT name FROM import_deferred')}
+        assert {tuple(row) for row in db.execute('SELECT type, name, sql FROM sqlite_master')} != schema
+
+        recover()
+        assert {tuple(row) for row in db.execute('SELECT type, name, sql FROM sqlite_master')} == schema
+        assert db.execute('SELECT COUNT(*) FROM import_deferred').fetchone()[0] == 0
+        assert [row[0] for row in db.execute("SELECT rowid FROM post_search WHERE post_search MATCH 'zweiter'")] == [2]
@@ -1,3 +1,5 @@
+import os
+
 from portfolio import create_app
 
 # The only behavior that can change is passing test config.
@@ -8,4 +10,17 @@ def test_config():
 
 def test_hello(client):
     response = client.get('/hello')
-    assert response.data == b'Hello, World!'
\ No newline at end of file
+    assert response.data == b'Hello, World!'
+
+def test_compile_templates(runner, app):
+    templates = len(app.jinja_env.list_templates())
+    result = runner.invoke(args=['compile-templates'])
+    assert f'Compiled {templates} templates' in result.output
+    # One cache file per template.
+    assert len(os.listdir(app.config['TEMPLATE_CACHE_DIR'])) == templates
+
+
+def test_template_bytecode_cache_off(tmp_path):
+    app = create_app({'TEMPLATE_BYTECODE_CACHE': False, 'TEMPLATE_CACHE_DIR': str(tmp_path / 'cache')})
+    assert app.jinja_env.bytecode_cache is None
+    assert not os.path.exists(tmp_path / 'cache')
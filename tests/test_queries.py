@@ -0,0 +1,28 @@
+from portfolio import queries
+from portfolio.db import get_db
+
+
+def test_statement_cache_stats(client, auth):
+    queries.reset_stats()
+
+    # Both requests get the same pooled connection, so only the first run of each query prepares it.
+    client.get('/')
+    client.get('/')
+    auth.login()
+
+    stats = queries.stats()
+    assert stats['queries']['post_version'] == {'hits': 1, 'misses': 1}
+    assert stats['queries']['posts_first_page'] == {'hits': 0, 'misses': 1}
+    assert stats['queries']['user_by_username'] == {'hits': 0, 'misses': 1}
+    # Logging in also upgrades the test user's old password hash.
+    assert stats['queries']['update_user_password'] == {'hits': 0, 'misses': 1}
+    assert stats['hits'] == 1
+    assert stats['misses'] == 4
+
+
+# Every query in the registry is valid SQL against the current schema.
+def test_queries_compile(app):
+    with app.app_context():
+        db = get_db()
+        for sql in queries.QUERIES.values():
+            db.execute('EXPLAIN ' + sql, (None,) * sql.count('?'))
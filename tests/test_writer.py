@@ -0,0 +1,77 @@
+import sqlite3
+import threading
+
+import pytest
+from portfolio.db import get_db
+from portfolio.writer import get_writer
+
+
+@pytest.fixture
+def group_commit(app):
+    app.config['GROUP_COMMIT'] = True
+    return get_writer(app)
+
+
+def test_views(client, auth, app, group_commit):
+    auth.login()
+    client.post('/create', data={'title': 'created', 'body': ''})
+    client.post('/1/update', data={'title': 'updated', 'body': ''})
+    assert b'created' in client.get('/').data
+    client.post('/2/delete')
+
+    with app.app_context():
+        titles = [row[0] for row in get_db().execute('SELECT title FROM post')]
+    assert titles == ['updated']
+    assert group_commit.commits == 3
+
+
+# Writes that arrive together share one commit, and each one still gets its own result.
+def test_batches(app, group_commit):
+    group_commit.max_delay = 0.5
+    ids = []
+    errors = []
+
+    def write(n):
+        try:
+            # The writes with an even n have no title, which the post table doesn't allow.
+            title = f'post {n}' if n % 2 else None
+            ids.append(group_commit.submit('insert_post', (title, '', '', 0, 0, 0, 1)))
+        except sqlite3.IntegrityError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert group_commit.commits <= 2
+    assert len(errors) == 5
+    assert len(ids) == 5
+    with app.app_context():
+        assert sorted(row[0] for row in get_db().execute('SELECT id FROM post WHERE id > 1')) == sorted(ids)
+
+
+def test_close(group_commit):
+    first = group_commit.submit('insert_post', ('one', '', '', 0, 0, 0, 1))
+    group_commit.close()
+    # The writer starts again when it is used after being closed.
+    assert group_commit.submit('insert_post', ('two', '', '', 0, 0, 0, 1)) == first + 1
+
+
+# An error that isn't the database's fails the whole batch instead of leaving its requests waiting, and the writer carries on.
+def test_unexpected_error(group_commit):
+    with pytest.raises(KeyError):
+        group_commit.submit('no_such_query')
+    assert group_commit.submit('insert_post', ('after', '', '', 0, 0, 0, 1)) == 2
+
+
+# A writer thread that died is started again by the next write.
+def test_dead_thread(group_commit):
+    group_commit.submit('insert_post', ('one', '', '', 0, 0, 0, 1))
+    thread = group_commit._thread
+    group_commit._queue.put(None)
+    thread.join()
+
+    assert group_commit.submit('insert_post', ('two', '', '', 0, 0, 0, 1)) == 3
+    assert group_commit._thread is not thread